@@ -0,0 +1,78 @@
+# Measures what batching paths with the same style gains on the examples.
+#
+# Runs each script in examples/, then draws the canvas without and with
+# Canvas.batch set. For both, it counts the calls made on the Cairo
+# context, how many of them fill, stroke or clip, and times the draw.
+# The batched draw is timed a second time, since the first one also
+# computes the bounds of the paths. Scripts that fail to run, for
+# instance because they need a library, are listed as skipped.
+#
+# Usage: python benchmarks/batching.py [example.py ...]
+
+from optparse import OptionParser
+
+import runner
+from runner import timed_draw, speedup
+
+PAINTS = ('Fill', 'FillPreserve', 'Stroke', 'Clip')
+
+class CountingContext(object):
+
+    """Passes everything on to a Cairo context, counting the calls
+    and the properties that are set."""
+
+    def __init__(self, context):
+        self.__dict__['_context'] = context
+        self.__dict__['calls'] = 0
+        self.__dict__['paints'] = 0
+
+    def __getattr__(self, name):
+        value = getattr(self._context, name)
+        if not callable(value):
+            return value
+        def call(*args):
+            self.__dict__['calls'] += 1
+            if name in PAINTS:
+                self.__dict__['paints'] += 1
+            return value(*args)
+        return call
+
+    def __setattr__(self, name, value):
+        self.__dict__['calls'] += 1
+        setattr(self._context, name, value)
+
+def counted_draw(canvas):
+    context = canvas._context
+    canvas._context = counter = CountingContext(context)
+    try:
+        canvas.draw()
+    finally:
+        canvas._context = context
+    return counter.calls, counter.paints
+
+def measure(fname):
+    canvas = runner.canvas(fname)
+
+    canvas.batch = False
+    calls, paints = counted_draw(canvas)
+    plain = timed_draw(canvas)
+    canvas.batch = True
+    first = timed_draw(canvas)
+    batched = timed_draw(canvas)
+    batched_calls, batched_paints = counted_draw(canvas)
+    return (len(canvas), canvas.stats['batched_paths'], calls, batched_calls,
+            paints, batched_paints, plain, first, batched, speedup(plain, batched))
+
+def main():
+    parser = OptionParser(usage="%prog [example.py ...]")
+    options, args = parser.parse_args()
+
+    runner.run(args,
+        "%-28s %6s %7s %8s %8s %7s %7s %10s %10s %10s %8s" % ("example", "grobs",
+        "batched", "calls", "batched", "paints", "batched", "plain", "batching",
+        "batched", "speedup"),
+        "%-28s %6d %7d %8d %8d %7d %7d %9.4fs %9.4fs %9.4fs %7.2fx",
+        measure)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# Compares the speed and accuracy of measuring curves
+# with a fixed number of chords against adaptive quadrature.
+#
+# Usage: python benchmarks/curvelength.py [curves]
+
+import os, sys, time
+from random import Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pathmatics import curvelength
+
+# Curve sizes, from a glyph detail to a poster-sized sweep.
+SIZES = (1, 10, 100, 1000, 10000)
+
+METHODS = (
+    ("n=10",      {'n': 10}),
+    ("n=20",      {'n': 20}),
+    ("tol=0.1",   {'tolerance': 0.1}),
+    ("tol=0.01",  {'tolerance': 0.01}),
+    ("tol=0.001", {'tolerance': 0.001}),
+)
+
+def make_curves(size, amount, seed=0):
+    rnd = Random(seed)
+    return [[rnd.uniform(0, size) for i in range(8)] for j in range(amount)]
+
+def measure(curves, kwargs):
+    t = time.time()
+    lengths = [curvelength(*c, **kwargs) for c in curves]
+    return time.time() - t, lengths
+
+def main(amount=2000):
+    print "%-10s %-10s %12s %14s %14s" % ("size", "method", "us/curve", "mean error", "max error")
+    for size in SIZES:
+        curves = make_curves(size, amount)
+        exact = [curvelength(*c, **{'tolerance': 1e-10}) for c in curves]
+        for name, kwargs in METHODS:
+            elapsed, lengths = measure(curves, kwargs)
+            errors = [abs(a - b) for a, b in zip(lengths, exact)]
+            print "%-10s %-10s %12.2f %14.6g %14.6g" % (size, name,
+                elapsed / amount * 1e6, sum(errors) / amount, max(errors))
+        print
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
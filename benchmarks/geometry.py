@@ -0,0 +1,325 @@
+# Measures how the geometry routines in bezier and pathmatics
+# scale with the size of the path. Needs no canvas or surface.
+#
+# Every routine runs on synthetic paths of growing size.
+# For each size it reports the best time and the throughput in elements
+# per second. For each routine it fits the exponent k in time ~ size**k,
+# so 1.0 is linear and 2.0 quadratic.
+#
+# Usage:
+#   python benchmarks/geometry.py [--max 1000000] [--only point,contours] [--output results.json]
+#   python benchmarks/geometry.py --compare before.json after.json
+#
+# The JSON files use the same sizes and random seed on every run, so the
+# files written by two commits can be compared. --compare prints the
+# ratio of each timing and exits with status 1 if any routine got slower
+# than the threshold.
+
+import os, sys, time
+from array import array
+from math import log
+from optparse import OptionParser
+from random import Random
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'nodebox', 'graphics'))
+
+from nodebox.graphics import BezierPath
+import bezier
+
+FORMAT = 1
+SEED = 0
+SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+
+# Elements in each contour of a synthetic path.
+CONTOUR = 100
+
+# Routines are timed again until this many seconds have passed,
+# and the best time counts.
+MIN_TIME = 0.2
+
+# A routine stops at the first size that takes longer than this.
+BUDGET = 10.0
+
+def make_path(size, seed=SEED):
+    """Returns a path of the given number of elements: closed contours
+    of a random walk, two thirds curves and one third lines."""
+    rnd = Random(seed)
+    path = BezierPath(None)
+    x = y = 0.0
+    i = 0
+    while i < size:
+        path.moveto(x, y)
+        i += 1
+        for j in xrange(min(CONTOUR - 2, size - i - 1)):
+            if j % 3 == 2:
+                x += rnd.uniform(-10, 10)
+                y += rnd.uniform(-10, 10)
+                path.lineto(x, y)
+            else:
+                c1x, c1y = x + rnd.uniform(-10, 10), y + rnd.uniform(-10, 10)
+                x += rnd.uniform(-10, 10)
+                y += rnd.uniform(-10, 10)
+                c2x, c2y = x + rnd.uniform(-10, 10), y + rnd.uniform(-10, 10)
+                path.curveto(c1x, c1y, c2x, c2y, x, y)
+            i += 1
+        if i < size:
+            path.closepath()
+            i += 1
+    return path
+
+def make_ts(amount, seed=SEED):
+    rnd = Random(seed)
+    return sorted([rnd.random() for i in xrange(amount)])
+
+# Each benchmark gets a fresh path of the requested size, prepares
+# its input and returns the function to time. Paths are measured cold:
+# caches are cleared before every run unless the name says otherwise.
+
+def bench_segment_lengths(path):
+    def run():
+        path._invalidate()
+        bezier.segment_lengths(path)
+    return run
+
+def bench_point(path):
+    # Lookups on a warm path: only the search should grow with the size.
+    ts = make_ts(1000)
+    path.point(0.5)
+    def run():
+        for t in ts:
+            path.point(t)
+    return run
+
+def bench_points(path):
+    def run():
+        path._invalidate()
+        for pt in bezier.points(path, 100, tuples=True):
+            pass
+    return run
+
+def bench_sample(path):
+    def run():
+        path._invalidate()
+        bezier.sample(path, len(path))
+    return run
+
+def bench_bounds(path):
+    def run():
+        bezier.bounds(path)
+    return run
+
+def bench_contours(path):
+    def run():
+        path._invalidate()
+        bezier.contours(path)
+    return run
+
+def bench_findpath(path):
+    coords = []
+    for el in path:
+        coords.append(el.x)
+        coords.append(el.y)
+    def run():
+        bezier.findpath(coords)
+    return run
+
+def bench_from_polyline(path):
+    coords = array('d')
+    for segment in path.iter_segments():
+        coords.extend(segment[1:3])
+    def run():
+        BezierPath.from_polyline(None, coords)
+    return run
+
+def bench_insert_point(path):
+    def run():
+        path._invalidate()
+        bezier.insert_point(path, 0.5)
+    return run
+
+def bench_insert_points(path):
+    ts = make_ts(100)
+    def run():
+        path._invalidate()
+        bezier.insert_points(path, ts)
+    return run
+
+def bench_flatten(path):
+    def run():
+        path._invalidate()
+        path.flatten()
+    return run
+
+def bench_contains(path):
+    rnd = Random(SEED)
+    (x, y), (w, h) = path.bounds
+    pts = [(x + rnd.random() * w, y + rnd.random() * h) for i in xrange(1000)]
+    def run():
+        path._invalidate()
+        path.contains_many(pts)
+    return run
+
+BENCHMARKS = (
+    ("segment_lengths", bench_segment_lengths),
+    ("point", bench_point),
+    ("points", bench_points),
+    ("sample", bench_sample),
+    ("bounds", bench_bounds),
+    ("contours", bench_contours),
+    ("findpath", bench_findpath),
+    ("from_polyline", bench_from_polyline),
+    ("insert_point", bench_insert_point),
+    ("insert_points", bench_insert_points),
+    ("flatten", bench_flatten),
+    ("contains", bench_contains),
+)
+
+def measure(run):
+    """Returns the best time of one run, running it
+    for at least MIN_TIME seconds in total."""
+    best = None
+    total = 0.0
+    while total < MIN_TIME:
+        t = time.time()
+        run()
+        elapsed = time.time() - t
+        total += elapsed
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def exponent(sizes, seconds):
+    """Fits k in seconds ~ size**k with least squares on a log-log scale.
+    Timings under a millisecond are mostly overhead and are left out
+    when there are enough others."""
+    pairs = [(s, t) for s, t in zip(sizes, seconds) if t >= 0.001]
+    if len(pairs) < 2:
+        pairs = zip(sizes, seconds)
+    pairs = [(log(s), log(max(t, 1e-9))) for s, t in pairs]
+    if len(pairs) < 2:
+        return None
+    n = len(pairs)
+    mx = sum([x for x, y in pairs]) / n
+    my = sum([y for x, y in pairs]) / n
+    sxx = sum([(x - mx) ** 2 for x, y in pairs])
+    sxy = sum([(x - mx) * (y - my) for x, y in pairs])
+    return sxy / sxx
+
+def revision():
+    try:
+        pipe = os.popen('git -C "%s" rev-parse --short HEAD' % ROOT)
+        rev = pipe.read().strip()
+        pipe.close()
+        return rev or None
+    except Exception:
+        return None
+
+def run_all(max_size, only=None):
+    results = {}
+    print "%-16s %10s %12s %16s" % ("routine", "size", "seconds", "elements/s")
+    for name, bench in BENCHMARKS:
+        if only and name not in only:
+            continue
+        sizes = []
+        seconds = []
+        for size in SIZES:
+            if size > max_size:
+                break
+            run = bench(make_path(size))
+            best = measure(run)
+            sizes.append(size)
+            seconds.append(best)
+            print "%-16s %10d %12.6f %16.0f" % (name, size, best, size / max(best, 1e-9))
+            if best > BUDGET:
+                break
+        k = exponent(sizes, seconds)
+        results[name] = {
+            'sizes': sizes,
+            'seconds': seconds,
+            'throughput': [s / max(t, 1e-9) for s, t in zip(sizes, seconds)],
+            'exponent': k,
+        }
+        if k is not None:
+            print "%-16s exponent %.2f" % (name, k)
+        print
+    return {
+        'format': FORMAT,
+        'seed': SEED,
+        'revision': revision(),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def compare(before, after, threshold):
+    """Prints the timings of two result files side by side.
+    Returns True if a routine became slower than the threshold allows."""
+    if before.get('format') != after.get('format'):
+        print "The files have different formats, they can't be compared."
+        return True
+    regressed = False
+    print "%-16s %10s %12s %12s %8s" % ("routine", "size", "before", "after", "ratio")
+    for name, _ in BENCHMARKS:
+        if name not in before['results'] or name not in after['results']:
+            continue
+        b, a = before['results'][name], after['results'][name]
+        timings = dict(zip(b['sizes'], b['seconds']))
+        for size, t in zip(a['sizes'], a['seconds']):
+            if size not in timings:
+                continue
+            ratio = t / max(timings[size], 1e-9)
+            flag = ""
+            # Very short timings are too noisy to call regressions.
+            if ratio > 1 + threshold and t >= 0.001:
+                flag = "slower"
+                regressed = True
+            print "%-16s %10d %12.6f %12.6f %8.2f %s" % (name, size, timings[size], t, ratio, flag)
+        print "%-16s exponent %s -> %s" % (name, _format(b['exponent']), _format(a['exponent']))
+        print
+    return regressed
+
+def _format(k):
+    if k is None:
+        return "-"
+    return "%.2f" % k
+
+def main():
+    parser = OptionParser(usage="%prog [options] | --compare before.json after.json")
+    parser.add_option("--max", type="int", default=SIZES[-1],
+                      help="largest path size to measure")
+    parser.add_option("--only", default="",
+                      help="comma-separated routines to measure")
+    parser.add_option("--output", default=None,
+                      help="write the results to this JSON file")
+    parser.add_option("--compare", action="store_true", default=False,
+                      help="compare two JSON files instead of measuring")
+    parser.add_option("--threshold", type="float", default=0.25,
+                      help="relative slowdown that counts as a regression")
+    options, args = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare needs two JSON files")
+        before = json.load(open(args[0]))
+        after = json.load(open(args[1]))
+        if compare(before, after, options.threshold):
+            sys.exit(1)
+        return
+
+    only = [name.strip() for name in options.only.split(",") if name.strip()]
+    data = run_all(options.max, only)
+    if options.output:
+        f = open(options.output, 'w')
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.close()
+
+if __name__ == '__main__':
+    main()
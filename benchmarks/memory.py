@@ -0,0 +1,158 @@
+# Measures how much memory the grobs of a drawn scene take.
+#
+# Builds a scene like examples/Superfolia_roots.py: a radial gradient
+# of ovals and recursive roots of lines and ovals, each with its own
+# fill, stroke and strokewidth. Nothing is rendered: draw() only stores
+# copies of the grobs on the canvas, and those copies are what the
+# benchmark measures.
+#
+# On IronPython the size comes from the .NET heap, elsewhere from
+# sys.getsizeof over everything a grob refers to. The numbers of both
+# methods are only comparable to themselves.
+#
+# Usage: python benchmarks/memory.py [--depth 6] [--output results.json]
+
+import os, sys
+from math import sin, cos, radians
+from optparse import OptionParser
+from random import Random
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'nodebox', 'graphics'))
+
+from nodebox.graphics import Context
+
+SEED = 0
+
+def radial_gradient(ctx, colors, x, y, radius, steps=300):
+    for i in xrange(steps):
+        d = 1.0 * i / steps
+        r = colors[0][0] * (1-d) + colors[1][0] * d
+        g = colors[0][1] * (1-d) + colors[1][1] * d
+        b = colors[0][2] * (1-d) + colors[1][2] * d
+        ctx.fill(r, g, b)
+        ctx.oval(x+i, y+i, radius-i*2, radius-i*2)
+
+def root(ctx, rnd, x, y, angle=0, depth=5, alpha=1.0, decay=0.005):
+    w = depth * 6
+    for i in xrange(depth * rnd.randint(10, 20)):
+        v = float(depth) / 5
+        alpha -= i * decay
+        alpha = max(0, alpha)
+        if alpha > 0:
+            angle += rnd.uniform(-60, 60)
+            dx = x + cos(radians(angle)) * w
+            dy = y + sin(radians(angle)) * w
+
+            ctx.nostroke()
+            ctx.fill(0, 0, 0, alpha*0.25)
+            ctx.oval(x-w/6+depth, y-w/6+depth, w/3, w/3)
+
+            ctx.nofill()
+            ctx.stroke(0.8-v*0.25, 0.8, 0.8-v, alpha)
+            ctx.strokewidth((depth+1)*0.5)
+            ctx.line(x, y, dx, dy)
+
+            ctx.strokewidth((depth+1)*0.25)
+            ctx.fill(0.8-v*0.25, 0.8, 0.8-v, alpha*0.5)
+            ctx.oval(x-w/6, y-w/6, w/3, w/3)
+
+            if rnd.random() > 0.8 and depth > 0:
+                root(ctx, rnd, x, y, angle, depth-1, alpha)
+
+            x = dx
+            y = dy
+
+    if depth > 0:
+        root(ctx, rnd, x, y, angle, depth-1, alpha)
+
+def build_scene(ctx, depth=6, seed=SEED):
+    rnd = Random(seed)
+    ctx.size(600, 600)
+    radial_gradient(ctx, [(0.05, 0.06, 0.0), (0.125, 0.150, 0.0)], -150, -150, radius=900)
+    root(ctx, rnd, 300, 300, angle=-90, depth=depth)
+
+def heap():
+    """Returns the bytes in use on the .NET heap, or None outside of IronPython."""
+    if sys.platform != 'cli':
+        return None
+    import System
+    return System.GC.GetTotalMemory(True)
+
+def deep_size(obj, seen):
+    """Returns the size of the object and everything it refers to
+    that hasn't been counted yet. The context is shared by all
+    grobs, so it isn't counted."""
+    if id(obj) in seen or obj is None:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    else:
+        d = getattr(obj, '__dict__', None)
+        if d is not None:
+            size += sys.getsizeof(d)
+            for key, value in d.iteritems():
+                if key != '_ctx':
+                    size += deep_size(value, seen)
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name != '_ctx' and hasattr(obj, name):
+                    size += deep_size(getattr(obj, name), seen)
+    return size
+
+def measure(depth):
+    before = heap()
+    ctx = Context()
+    build_scene(ctx, depth)
+    after = heap()
+    grobs = list(ctx.canvas)
+    elements = sum([len(grob) for grob in grobs if hasattr(grob, '__len__')])
+    if before is not None:
+        method = 'heap'
+        total = after - before
+    else:
+        method = 'getsizeof'
+        seen = set()
+        total = sum([deep_size(grob, seen) for grob in grobs])
+    return {
+        'method': method,
+        'depth': depth,
+        'grobs': len(grobs),
+        'elements': elements,
+        'bytes': total,
+        'bytes_per_grob': float(total) / max(len(grobs), 1),
+        'bytes_per_element': float(total) / max(elements, 1),
+    }
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--depth", type="int", default=6,
+                      help="depth of the roots, which sets the size of the scene")
+    parser.add_option("--output", default=None,
+                      help="write the results to this JSON file")
+    options, args = parser.parse_args()
+
+    result = measure(options.depth)
+    print "%d grobs, %d path elements, measured with %s" % (
+        result['grobs'], result['elements'], result['method'])
+    print "%d bytes, %.0f bytes per grob, %.0f bytes per element" % (
+        result['bytes'], result['bytes_per_grob'], result['bytes_per_element'])
+    if options.output:
+        f = open(options.output, 'w')
+        json.dump(result, f, indent=1, sort_keys=True)
+        f.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Runner - what the benchmarks that draw the examples share.
+#
+# Such a benchmark runs each script in examples/, or the scripts given on
+# the command line, measures something on its canvas and prints a row of
+# results for it. Scripts that fail to run, for instance because they
+# need a library, are listed as skipped at the end.
+#
+# Importing this module puts the repository on sys.path, so the
+# benchmarks import it before anything from nodebox.
+
+import os, sys, time
+from glob import glob
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'nodebox', 'graphics'))
+
+from console import NodeBoxRunner
+
+def canvas(fname):
+    """Runs the script and returns the canvas it drew on."""
+    runner = NodeBoxRunner()
+    source = open(fname).read()
+    runner.run(source)
+    return runner.canvas
+
+def timed_draw(canvas):
+    """Draws the canvas and returns how many seconds it took."""
+    t = time.time()
+    canvas.draw()
+    return time.time() - t
+
+def speedup(before, after):
+    """Returns how many times faster after is than before."""
+    return before / max(after, 1e-9)
+
+def run(files, header, row, measure):
+    """Prints the header, then for each script the values that measure(fname)
+    returns, formatted with row after the name of the script, then the
+    scripts that were skipped. Without files, runs the examples."""
+    files = files or sorted(glob(os.path.join(ROOT, 'examples', '*.py')))
+    print header
+    skipped = []
+    for fname in files:
+        name = os.path.basename(fname)
+        try:
+            values = measure(fname)
+        except Exception, e:
+            skipped.append((name, e))
+            continue
+        print row % ((name,) + tuple(values))
+    for name, e in skipped:
+        print "skipped %s: %s" % (name, e)
@@ -0,0 +1,65 @@
+# Measures what simplifying paths before they are drawn gains on the examples.
+#
+# Runs each script in examples/, then counts the path elements on the
+# canvas. After one untimed draw, which computes the bounds and other
+# geometry every draw uses, it times Canvas.draw() three times:
+#   as drawn:    without simplification
+#   simplifying: with Canvas.simplify set, the first time, which
+#                includes simplifying every path
+#   simplified:  again, with the simplified paths cached
+# The ratio of the elements after and before simplifying is listed next
+# to the speedup: where it is 1.00, nothing was simplified. Scripts that
+# fail to run, for instance because they need a library, are listed as skipped.
+#
+# Usage: python benchmarks/simplify.py [--tolerance 0.1] [example.py ...]
+
+from optparse import OptionParser
+
+import runner
+from runner import timed_draw, speedup
+
+from nodebox.graphics import BezierPath, ClippingPath
+from nodebox.graphics.caironet import FLATNESS
+
+def paths(grobs):
+    for grob in grobs:
+        if isinstance(grob, BezierPath):
+            yield grob
+        elif isinstance(grob, ClippingPath):
+            for path in paths(grob._grobs):
+                yield path
+
+def measure(fname, tolerance):
+    canvas = runner.canvas(fname)
+
+    found = list(paths(canvas))
+    before = sum([len(path) for path in found])
+    after = sum([len(path._simplified(tolerance)) for path in found])
+    # Forget the simplified paths, so the first simplifying draw makes them.
+    for path in found:
+        path._geometry = None
+
+    canvas.simplify = None
+    # Compute what every draw uses, so only simplifying makes a difference.
+    canvas.draw()
+    plain = timed_draw(canvas)
+    canvas.simplify = tolerance
+    first = timed_draw(canvas)
+    cached = timed_draw(canvas)
+    return (len(found), before, after, plain, first, cached,
+            float(after) / max(before, 1), speedup(plain, cached))
+
+def main():
+    parser = OptionParser(usage="%prog [options] [example.py ...]")
+    parser.add_option("--tolerance", type="float", default=FLATNESS,
+                      help="the tolerance to simplify with")
+    options, args = parser.parse_args()
+
+    runner.run(args,
+        "%-28s %6s %9s %9s %11s %11s %11s %7s %8s" % ("example", "paths",
+        "elements", "after", "as drawn", "simplifying", "simplified", "ratio", "speedup"),
+        "%-28s %6d %9d %9d %10.4fs %10.4fs %10.4fs %7.2f %7.2fx",
+        lambda fname: measure(fname, options.tolerance))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Measures what drawing in tiles on several threads gains on the examples.
+#
+# Runs each script in examples/, optionally on a larger canvas, then
+# times Canvas.draw() on one thread and in tiles on a pool of threads,
+# and lists how many tiles were drawn. Threads only run at the same time
+# on IronPython. Scripts that fail to run, for instance because they
+# need a library, are listed as skipped.
+#
+# Usage: python benchmarks/tiles.py [--tilesize 512] [--workers n] [--size 8192]
+#                                   [example.py ...]
+
+from optparse import OptionParser
+
+import runner
+from runner import timed_draw, speedup
+
+from nodebox.graphics.tiles import TILESIZE
+
+def measure(fname, tilesize, workers, size):
+    canvas = runner.canvas(fname)
+    if size:
+        # Draw the same grobs on a larger image, the way a poster would be.
+        canvas.width = canvas.height = size
+        canvas._resize()
+
+    canvas.tilesize = None
+    # The first draw computes what the grobs cache, for both draws to use.
+    canvas.draw()
+    plain = timed_draw(canvas)
+    canvas.tilesize = tilesize
+    canvas.workers = workers
+    tiled = timed_draw(canvas)
+    return len(canvas), canvas.stats['tiles'], plain, tiled, speedup(plain, tiled)
+
+def main():
+    parser = OptionParser(usage="%prog [options] [example.py ...]")
+    parser.add_option("--tilesize", type="int", default=TILESIZE,
+                      help="the size of the tiles in pixels")
+    parser.add_option("--workers", type="int", default=None,
+                      help="the number of threads, by default one for each processor")
+    parser.add_option("--size", type="int", default=None,
+                      help="draw on a square canvas of this many pixels")
+    options, args = parser.parse_args()
+
+    runner.run(args,
+        "%-28s %6s %6s %10s %10s %8s" % ("example", "grobs", "tiles",
+        "plain", "tiled", "speedup"),
+        "%-28s %6d %6d %9.4fs %9.4fs %7.2fx",
+        lambda fname: measure(fname, options.tilesize, options.workers, options.size))
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import weakref
+
 from nodebox.graphics.caironet import *
 from nodebox.graphics import caironet
 
@@ -30,6 +32,7 @@ class Context(object):
         self._ns = ns
         self._imagecache = {}
         self._vars = []
+        self._styles = weakref.WeakValueDictionary()
         self._resetContext()
 
     def _resetContext(self):
@@ -42,6 +45,7 @@ class Context(object):
         self.canvas.background = self.Color(1.0)
         self._path = None
         self._autoclosepath = True
+        self.canvas.simplify = None
         self._transform = self.Transform()
         self._transformmode = CENTER
         self._transformstack = []
@@ -114,6 +118,17 @@ class Context(object):
                 return v
         return None
 
+    def _style(self):
+        """Returns the Style of the current state.
+        As long as grobs use it, the same state gives the same Style."""
+        values = (self._fillcolor, self._strokecolor, self._strokewidth,
+                  self._transform, self._transformmode)
+        key = caironet.Style.key(*values)
+        style = self._styles.get(key)
+        if style is None:
+            style = self._styles[key] = caironet.Style(*values)
+        return style
+
     ### Objects ####
     
     def _makeInstance(self, clazz, args, kwargs):
@@ -178,6 +193,15 @@ class Context(object):
           p.draw()
         return p
 
+    def polyline(self, coords, closed=False, draw=True, **kwargs):
+        """Draws lines through a flat sequence of coordinates: x, y, x, y, ..."""
+        BezierPath.checkKwargs(kwargs)
+        p = BezierPath.from_polyline(self, coords, closed, **kwargs)
+        p.inheritFromContext(kwargs.keys())
+        if draw:
+          p.draw()
+        return p
+
     def star(self, startx, starty, points=20, outer= 100, inner = 50, draw=True, **kwargs):
         BezierPath.checkKwargs(kwargs)
         from math import sin, cos, pi
@@ -315,9 +339,14 @@ class Context(object):
     def autoclosepath(self, close=True):
         self._autoclosepath = close
 
-    def findpath(self, points, curvature=1.0):
+    def autosimplify(self, tolerance=caironet.FLATNESS):
+        """Simplifies every path within tolerance before it is drawn.
+        The paths themselves don't change. Use None to turn it off."""
+        self.canvas.simplify = tolerance
+
+    def findpath(self, points, curvature=1.0, closed=False):
         import bezier
-        path = bezier.findpath(points, curvature=curvature)
+        path = bezier.findpath(points, curvature=curvature, closed=closed)
         path._ctx = self
         path.inheritFromContext()
         return path
@@ -5,15 +5,27 @@
 # Refer to the "Use" section on http://nodebox.net/code
 # Thanks to Dr. Florimond De Smedt at the Free University of Brussels for the math routines.
 
-from nodebox.graphics import BezierPath, PathElement, NodeBoxError, Point, MOVETO, LINETO, CURVETO, CLOSE
+from array import array
+from bisect import bisect_left, bisect_right
+from math import sqrt
+
+from nodebox.graphics import BezierPath, PathElement, NodeBoxError, Point, MOVETO, LINETO, CURVETO, CLOSE, RECT
+from nodebox.graphics.caironet import FLATNESS, LENGTH_TOLERANCE
+from flatten import curvesteps
 
 try:
-    from cPathmatics import linepoint, linelength, curvepoint, curvelength
+    from cPathmatics import linepoint, linelength, curvepoint, curvelength, \
+        linepoints, curvepoints, curvebounds
 except:
-    from pathmatics import linepoint, linelength, curvepoint, curvelength
+    from pathmatics import linepoint, linelength, curvepoint, curvelength, \
+        linepoints, curvepoints, curvebounds
     
-def segment_lengths(path, relative=False, n=20):
+def segment_lengths(path, relative=False, n=None, tolerance=LENGTH_TOLERANCE):
     """Returns a list with the lengths of each segment in the path.
+
+    Curves are measured adaptively until the error on each curve
+    is below the tolerance (see pathmatics.curvelength),
+    or with n points if n is set, like BezierPath.segmentlengths().
     
     >>> path = BezierPath(None)
     >>> segment_lengths(path)
@@ -34,29 +46,38 @@ def segment_lengths(path, relative=False, n=20):
     >>> path.curveto(3, 4, 5, 6, 7, 8)
     >>> segment_lengths(path)
     [8.4852813742385695]
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.curveto(6, 8, 12, 16, 30, 40)
+    >>> segment_lengths(path)
+    [50.0]
+    >>> segment_lengths(path) == path.segmentlengths()
+    True
     """
 
+    if n is not None:
+        tolerance = None
+    n = n or 20
     lengths = []
     first = True
 
-    for el in path:
+    for cmd, x3, y3, x1, y1, x2, y2 in path.iter_segments():
         if first == True:
-            close_x, close_y = el.x, el.y
+            close_x, close_y = x3, y3
             first = False
-        elif el.cmd == MOVETO:
-            close_x, close_y = el.x, el.y
+        elif cmd == MOVETO:
+            close_x, close_y = x3, y3
             lengths.append(0.0)
-        elif el.cmd == CLOSE:
+        elif cmd == CLOSE:
             lengths.append(linelength(x0, y0, close_x, close_y))
-        elif el.cmd == LINETO:
-            lengths.append(linelength(x0, y0, el.x, el.y))
-        elif el.cmd == CURVETO:
-            x3, y3, x1, y1, x2, y2 = el.x, el.y, el.ctrl1.x, el.ctrl1.y, el.ctrl2.x, el.ctrl2.y
-            lengths.append(curvelength(x0, y0, x1, y1, x2, y2, x3, y3, n))
+        elif cmd == LINETO:
+            lengths.append(linelength(x0, y0, x3, y3))
+        elif cmd == CURVETO:
+            lengths.append(curvelength(x0, y0, x1, y1, x2, y2, x3, y3, n, tolerance))
             
-        if el.cmd != CLOSE:
-            x0 = el.x
-            y0 = el.y
+        if cmd != CLOSE:
+            x0 = x3
+            y0 = y3
 
     if relative:
         length = sum(lengths)
@@ -67,12 +88,14 @@ def segment_lengths(path, relative=False, n=20):
     else:
         return lengths
 
-def length(path, segmented=False, n=20):
+def length(path, segmented=False, n=None, tolerance=LENGTH_TOLERANCE):
 
     """Returns the length of the path.
 
-    Calculates the length of each spline in the path,
-    using n as a number of points to measure.
+    Calculates the length of each spline in the path
+    up to the given tolerance, or using n as a number
+    of points to measure if n is set. Gives the same
+    result as BezierPath.length.
 
     When segmented is True, returns a list
     containing the individual length of each spline
@@ -100,9 +123,9 @@ def length(path, segmented=False, n=20):
     """
 
     if not segmented:
-        return sum(segment_lengths(path, n=n), 0.0)
+        return sum(segment_lengths(path, n=n, tolerance=tolerance), 0.0)
     else:
-        return segment_lengths(path, relative=True, n=n)
+        return segment_lengths(path, relative=True, n=n, tolerance=tolerance)
 
 def _locate(path, t, segments=None):
     
@@ -139,28 +162,136 @@ def _locate(path, t, segments=None):
     NodeBoxError: The given path is empty
     >>> path.lineto(100, 100)
     >>> _locate(path, 0.0)
-    (0, 0.0, Point(x=0.0, y=0.0))
+    (0, 0.0, Point(x=0.000, y=0.000))
     >>> _locate(path, 1.0)
-    (0, 1.0, Point(x=0.0, y=0.0))
+    (0, 1.0, Point(x=0.000, y=0.000))
     """
     
     if segments == None:
         segments = path.segmentlengths(relative=True)
+        cumulative, starts = path._lookup()
+    else:
+        cumulative, starts = lookup_table(path, segments)
         
     if len(segments) == 0:
         raise NodeBoxError, "The given path is empty"
     
-    for i, el in enumerate(path):
-        if i == 0 or el.cmd == MOVETO:
-            closeto = Point(el.x, el.y)
-        if t <= segments[i] or i == len(segments)-1: break
-        else: t -= segments[i]
+    i, t = _find(segments, cumulative, t)
+    closeto = _closeto(path, starts, i)
+    if i == len(segments)-1 and segments[i] == 0: i -= 1
+    
+    return (i, t, closeto)
 
+def _find(segments, cumulative, t, lo=0):
+
+    """Finds the segment that contains t with a binary search.
+    
+    Returns (index, t), where t is the absolute time on the segment.
+    The search starts at segment lo, any segment before that is skipped.
+    """
+
+    last = len(segments)-1
+    i = min(bisect_left(cumulative, t, lo), last)
+    if i > 0: t -= cumulative[i-1]
     try: t /= segments[i]
     except ZeroDivisionError: pass
-    if i == len(segments)-1 and segments[i] == 0: i -= 1
+    return (i, t)
+
+def _closeto(path, starts, i):
+
+    """Returns the point a CLOSE in segment i closes to:
+    the start of the contour that segment is part of."""
+
+    cmd, x, y = path._segment(starts[bisect_right(starts, i)-1])[:3]
+    return Point(x, y)
+
+def lookup_table(path, segments=None):
+
+    """Returns a table to quickly locate t on the path.
+
+    Returns (cumulative, starts), where cumulative is a list
+    with the relative position at which each segment ends,
+    and starts a list with the index of the element that
+    starts each contour. Both lists are sorted, so the segment
+    that contains t can be found with a binary search,
+    instead of walking the path from the start.
+
+    The BezierPath caches this table until it is changed.
+
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.lineto(100, 0)
+    >>> path.moveto(0, 100)
+    >>> path.lineto(0, 400)
+    >>> lookup_table(path)
+    ([0.25, 0.25, 1.0], [0, 2])
+    """
+
+    if segments == None:
+        segments = segment_lengths(path, relative=True)
+
+    cumulative = []
+    total = 0.0
+    for l in segments:
+        total += l
+        cumulative.append(total)
+
+    starts = [i for i, segment in enumerate(path.iter_segments()) if i == 0 or segment[0] == MOVETO]
+    return (cumulative, starts)
+
+def _locate_batch(path, ts, segments=None):
+
+    """Locates a sorted sequence of t values on the segments of the path.
+
+    Yields (index, ts, Point) for each segment that contains
+    one or more of the given t values, where ts is the list
+    of absolute times on that segment.
+
+    This gives the same results as calling _locate() for each t,
+    but each search continues where the previous one ended,
+    so the t values must be in ascending order.
     
-    return (i, t, closeto)
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.lineto(100, 0)
+    >>> path.lineto(100, 300)
+    >>> list(_locate_batch(path, [0.0, 0.125, 0.5, 1.0]))
+    [(0, [0.0, 0.5], Point(x=0.000, y=0.000)), (1, [0.3333333333333333, 1.0], Point(x=0.000, y=0.000))]
+    """
+
+    if segments == None:
+        segments = path.segmentlengths(relative=True)
+        cumulative, starts = path._lookup()
+    else:
+        cumulative, starts = lookup_table(path, segments)
+
+    if len(segments) == 0:
+        raise NodeBoxError, "The given path is empty"
+
+    last = len(segments)-1
+    i = 0
+    batch = []
+    closeto = None
+    closeto_index = None
+
+    for t in ts + [None]:
+        if t is not None:
+            j, t = _find(segments, cumulative, t, i)
+        if (t is None or j != i) and batch:
+            # Segments in the same contour close to the same point.
+            start = starts[bisect_right(starts, i)-1]
+            if start != closeto_index:
+                cmd, x, y = path._segment(start)[:3]
+                closeto = Point(x, y)
+                closeto_index = start
+            if i == last and segments[i] == 0:
+                yield (i-1, batch, closeto)
+            else:
+                yield (i, batch, closeto)
+            batch = []
+        if t is not None:
+            i = j
+            batch.append(t)
 
 def point(path, t, segments=None):
 
@@ -191,9 +322,9 @@ def point(path, t, segments=None):
     NodeBoxError: The given path is empty
     >>> path.lineto(100, 0)
     >>> point(path, 0.0)
-    PathElement(LINETO, ((0.0, 0.0),))
+    PathElement(LINETO, ((0.000, 0.000),))
     >>> point(path, 0.1)
-    PathElement(LINETO, ((10.0, 0.0),))
+    PathElement(LINETO, ((10.000, 0.000),))
     """
 
     if len(path) == 0:
@@ -201,28 +332,30 @@ def point(path, t, segments=None):
 
     i, t, closeto = _locate(path, t, segments=segments)
 
-    x0, y0 = path[i].x, path[i].y
-    p1 = path[i+1]
+    x0, y0 = path._segment(i)[1:3]
+    p1 = path._segment(i+1)
+    cmd, x3, y3, x1, y1, x2, y2 = p1
 
-    if p1.cmd == CLOSE:
+    if cmd == CLOSE:
         x, y = linepoint(t, x0, y0, closeto.x, closeto.y)
         return PathElement(LINETO, ((x, y),))
-    elif p1.cmd == LINETO:
-        x1, y1 = p1.x, p1.y
-        x, y = linepoint(t, x0, y0, x1, y1)
+    elif cmd == LINETO:
+        x, y = linepoint(t, x0, y0, x3, y3)
         return PathElement(LINETO, ((x, y),))
-    elif p1.cmd == CURVETO:
-        x3, y3, x1, y1, x2, y2 = p1.x, p1.y, p1.ctrl1.x, p1.ctrl1.y, p1.ctrl2.x, p1.ctrl2.y
+    elif cmd == CURVETO:
         x, y, c1x, c1y, c2x, c2y = curvepoint(t, x0, y0, x1, y1, x2, y2, x3, y3)
         return PathElement(CURVETO, ((c1x, c1y), (c2x, c2y), (x, y)))
     else:
-        raise NodeBoxError, "Unknown cmd for p1 %s" % p1
+        raise NodeBoxError, "Unknown cmd for p1 %s" % path[i+1]
         
-def points(path, amount=100):
+def points(path, amount=100, tuples=False):
     """Returns an iterator with a list of calculated points for the path.
     This method calls the point method <amount> times, increasing t,
     distributing point spacing linearly.
 
+    When tuples is True, yields plain (x, y) tuples
+    instead of PathElements, which is a lot cheaper.
+
     >>> path = BezierPath(None)
     >>> list(points(path))
     Traceback (most recent call last):
@@ -235,7 +368,65 @@ def points(path, amount=100):
     NodeBoxError: The given path is empty
     >>> path.lineto(100, 0)
     >>> list(points(path, amount=4))
-    [PathElement(LINETO, ((0.0, 0.0),)), PathElement(LINETO, ((25.0, 0.0),)), PathElement(LINETO, ((50.0, 0.0),)), PathElement(LINETO, ((75.0, 0.0),))]
+    [PathElement(LINETO, ((0.000, 0.000),)), PathElement(LINETO, ((33.333, 0.000),)), PathElement(LINETO, ((66.667, 0.000),)), PathElement(LINETO, ((100.000, 0.000),))]
+    >>> list(points(path, amount=3, tuples=True))
+    [(0.0, 0.0), (50.0, 0.0), (100.0, 0.0)]
+    """
+
+    for cmd, coords in _sample(path, amount, controls=not tuples):
+        if tuples:
+            for j in xrange(0, len(coords), 2):
+                yield (coords[j], coords[j+1])
+        elif cmd == CURVETO:
+            for j in xrange(0, len(coords), 6):
+                x, y, c1x, c1y, c2x, c2y = coords[j:j+6]
+                yield PathElement(CURVETO, ((c1x, c1y), (c2x, c2y), (x, y)))
+        else:
+            for j in xrange(0, len(coords), 2):
+                yield PathElement(LINETO, ((coords[j], coords[j+1]),))
+
+def sample(path, amount=100, out=None):
+    """Returns the coordinates of amount points evenly spread over the path.
+
+    Samples the same points as points(), but returns them
+    as a flat array of interleaved coordinates: [x, y, x, y, ...].
+    
+    To avoid allocating a new array on every call, supply your own
+    as out: an array, list or other mutable sequence with room
+    for at least 2 * amount values. It is filled and returned.
+
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.lineto(100, 0)
+    >>> sample(path, amount=3)
+    array('d', [0.0, 0.0, 50.0, 0.0, 100.0, 0.0])
+    >>> out = [None] * 6
+    >>> sample(path, amount=2, out=out)
+    [0.0, 0.0, 100.0, 0.0, None, None]
+    """
+
+    if out is None:
+        out = array('d', [0.0]) * (2*amount)
+    elif len(out) < 2*amount:
+        raise NodeBoxError, "The given sequence is too small for %d points" % amount
+
+    j = 0
+    for cmd, coords in _sample(path, amount):
+        n = len(coords)
+        out[j:j+n] = coords
+        j += n
+    return out
+
+def _sample(path, amount, controls=False):
+    """Samples amount points evenly spread over the path.
+
+    Streams the samples one segment at a time:
+    yields (cmd, coords) for each segment that contains samples,
+    with the flat coordinates as returned by linepoints(),
+    or by curvepoints() for a CURVETO.
+
+    The segments are found in a single pass over the path,
+    since each search continues where the previous one ended.
     """
 
     if len(path) == 0:
@@ -250,8 +441,136 @@ def points(path, amount=100):
     except ZeroDivisionError:
         delta = 1.0
 
-    for i in xrange(amount):
-        yield point(path, delta*i)
+    # Group the t values per segment so each segment
+    # is evaluated in a single batch.
+    ts = [delta*i for i in xrange(amount)]
+    p1 = None
+    for i, segment_ts, closeto in _locate_batch(path, ts):
+        # Consecutive segments share a point, so reuse the previous end point.
+        if p1 is not None and i == p1_index:
+            p0 = p1
+        else:
+            p0 = path._segment(i)
+        p1 = path._segment(i+1)
+        p1_index = i+1
+        x0, y0 = p0[1], p0[2]
+        cmd, x3, y3, x1, y1, x2, y2 = p1
+
+        if cmd == CLOSE:
+            yield LINETO, linepoints(segment_ts, x0, y0, closeto.x, closeto.y)
+        elif cmd == LINETO:
+            yield LINETO, linepoints(segment_ts, x0, y0, x3, y3)
+        elif cmd == CURVETO:
+            yield CURVETO, curvepoints(segment_ts, x0, y0, x1, y1, x2, y2, x3, y3, controls)
+        else:
+            raise NodeBoxError, "Unknown cmd for p1 %s" % path[i+1]
+
+def bounds(path):
+    """Returns the bounding box of the path as ((x, y), (width, height)).
+
+    The bounds are calculated from the geometry itself:
+    the end points of each segment and the points where curves turn.
+    They don't include the stroke, see BezierPath.strokebounds.
+    A MOVETO that isn't followed by a segment doesn't count.
+
+    >>> path = BezierPath(None)
+    >>> bounds(path)
+    ((0, 0), (0, 0))
+    >>> path.moveto(10, 20)
+    >>> path.lineto(110, 20)
+    >>> bounds(path)
+    ((10.0, 20.0), (100.0, 0.0))
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.curveto(0, 100, 100, 100, 100, 0)
+    >>> bounds(path)
+    ((0.0, 0.0), (100.0, 75.0))
+    >>> path.rect(50, -50, 100, 20)
+    >>> bounds(path)
+    ((0.0, -50.0), (150.0, 125.0))
+
+    After a CLOSE, the next segment starts where the contour started:
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.lineto(100, 0)
+    >>> path.lineto(100, 100)
+    >>> path.closepath()
+    >>> path.curveto(-100, 0, -100, 100, 0, 100)
+    >>> bounds(path)
+    ((-75.0, 0.0), (175.0, 100.0))
+    """
+
+    min_x = min_y = max_x = max_y = None
+    pending = None
+    x0 = y0 = start_x = start_y = 0.0
+
+    for cmd, x3, y3, x1, y1, x2, y2 in path.iter_segments():
+        if cmd == MOVETO:
+            pending = (x3, y3)
+            x0, y0 = start_x, start_y = x3, y3
+            continue
+        elif cmd == CLOSE:
+            # Closes to a point that is already included,
+            # and goes on from there, as in Cairo.
+            x0, y0 = start_x, start_y
+            continue
+        elif cmd == RECT:
+            start_x, start_y = x3, y3
+            box = (x3, y3, x3 + x1, y3 + y1)
+            box = (min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3]))
+        elif cmd == LINETO:
+            box = (min(x0, x3), min(y0, y3), max(x0, x3), max(y0, y3))
+        elif cmd == CURVETO:
+            box = curvebounds(x0, y0, x1, y1, x2, y2, x3, y3)
+        else:
+            continue
+
+        if pending is not None:
+            x, y = pending
+            box = (min(box[0], x), min(box[1], y), max(box[2], x), max(box[3], y))
+            pending = None
+        if min_x is None:
+            min_x, min_y, max_x, max_y = box
+        else:
+            min_x, min_y = min(min_x, box[0]), min(min_y, box[1])
+            max_x, max_y = max(max_x, box[2]), max(max_y, box[3])
+        x0, y0 = x3, y3
+
+    if min_x is None:
+        # Path is empty -- no bounds
+        return (0, 0), (0, 0)
+    return (min_x, min_y), (max_x - min_x, max_y - min_y)
+
+def contains(path, x, y, evenodd=False):
+    """Returns True if the point (x, y) is inside the path.
+
+    Open contours are closed, as when the path is filled.
+    Uses the non-zero winding rule, like fill() does,
+    or the even-odd rule when evenodd is True.
+    The path is flattened and its edges are indexed once;
+    both are cached on the path until it changes.
+
+    >>> path = BezierPath(None)
+    >>> path.rect(0, 0, 100, 100)
+    >>> path.oval(25, 25, 50, 50)
+    >>> contains(path, 10, 10), contains(path, 50, 50), contains(path, 150, 50)
+    (True, True, False)
+    >>> contains(path, 50, 50, evenodd=True)
+    False
+    """
+    return path._edgeindex().contains(x, y, evenodd)
+
+def contains_many(path, points, evenodd=False):
+    """Returns a list of booleans telling which of the (x, y) points
+    are inside the path. See contains().
+
+    >>> path = BezierPath(None)
+    >>> path.oval(0, 0, 100, 100)
+    >>> contains_many(path, [(50, 50), (1, 1), (99, 50)])
+    [True, False, True]
+    """
+    test = path._edgeindex().contains
+    return [test(x, y, evenodd) for x, y in points]
 
 def contours(path):
     """Returns a list of contours in the path.
@@ -262,6 +581,9 @@ def contours(path):
     For example, the glyph "o" has two contours:
     the inner circle and the outer circle.
 
+    The contours are views of the path: they share its elements
+    until either of them changes. See BezierPath.contours.
+
     >>> path = BezierPath(None)
     >>> path.moveto(0, 0)
     >>> path.lineto(100, 100)
@@ -284,31 +606,61 @@ def contours(path):
     >>> path.closepath()
     >>> len(contours(path))
     2
+
+    Changing a contour doesn't change the path:
+    >>> contour = contours(path)[1]
+    >>> contour[1]
+    PathElement(CURVETO, ((150.000, 150.000), (50.000, 250.0), (80.000, 95.000))
+    >>> contour.lineto(0, 0)
+    >>> len(contour), len(path)
+    (3, 7)
+
+    Copies of a contour hold only the contour:
+    >>> contour = contours(path)[1]
+    >>> len(contour.copy()), len(BezierPath(None, contour))
+    (2, 2)
+    >>> BezierPath(None, contour)[0]
+    PathElement(MOVETO, ((50.000, 50.000),))
     """
-    contours = []
-    current_contour = None
+    return path.contours
+
+def contour_ranges(path):
+    """Returns where the contours of the path start and end, as a list
+    of (start, end) tuples with the index of the first element of each
+    contour and the index after its last one.
+
+    A contour starts at a MOVETO and ends where the next one starts.
+    Contours without lines or curves are left out.
+    A RECT is a contour of its own.
+
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.lineto(100, 100)
+    >>> path.moveto(50, 50)
+    >>> path.moveto(60, 60)
+    >>> path.curveto(150, 150, 50, 250, 80, 95)
+    >>> path.closepath()
+    >>> path.rect(0, 0, 10, 10)
+    >>> contour_ranges(path)
+    [(0, 2), (3, 6), (6, 7)]
+    """
+    ranges = []
+    start = 0
     empty = True
-    for i, el in enumerate(path):
-        if el.cmd == MOVETO:
+    for i, segment in enumerate(path.iter_segments()):
+        cmd = segment[0]
+        if cmd == MOVETO or cmd == RECT:
             if not empty:
-                contours.append(current_contour)
-            current_contour = BezierPath(path._ctx)
-            current_contour.moveto(el.x, el.y)
-            empty = True
-        elif el.cmd == LINETO:
-            empty = False
-            current_contour.lineto(el.x, el.y)
-        elif el.cmd == CURVETO:
+                ranges.append((start, i))
+            start = i
+            empty = cmd == MOVETO
+        elif cmd == LINETO or cmd == CURVETO:
             empty = False
-            current_contour.curveto(el.ctrl1.x, el.ctrl1.y,
-                el.ctrl2.x, el.ctrl2.y, el.x, el.y)
-        elif el.cmd == CLOSE:
-            current_contour.closepath()
     if not empty:
-        contours.append(current_contour)
-    return contours
+        ranges.append((start, len(path)))
+    return ranges
     
-def findpath(points, curvature=1.0):
+def findpath(points, curvature=1.0, closed=False):
     
     """Constructs a path between the given list of points.
     
@@ -319,67 +671,176 @@ def findpath(points, curvature=1.0):
     how separate segments are stitched together:
     from straight angles to smooth curves.
     Curvature is only useful if the path has more than  three points.
+
+    The points can be Point objects, (x, y)-tuples,
+    or a flat sequence of coordinates: [x0, y0, x1, y1, ...].
+    The given list is left untouched.
+
+    When closed is True, the path loops back to the first point
+    and is just as smooth there as anywhere else.
+
+    >>> path = findpath([(0, 0), (100, 0), (100, 100)])
+    >>> len(path)
+    3
+    >>> path[1]
+    PathElement(CURVETO, ((0.000, 0.000), (75.000, -25.0), (100.000, 0.000))
+    >>> path = findpath([0, 0, 100, 0, 100, 100, 0, 100], closed=True)
+    >>> len(path)
+    6
+    >>> path[1]
+    PathElement(CURVETO, ((25.000, -25.000), (75.000, -25.0), (100.000, 0.000))
+    >>> path[-1].cmd == CLOSE
+    True
     """
     
-    # The list of points consists of Point objects,
-    # but it shouldn't crash on something straightforward
-    # as someone supplying a list of (x,y)-tuples.
-    
-    for i, pt in enumerate(points):
-        if type(pt) == tuple:
-            points[i] = Point(pt[0], pt[1])
-    
-    if len(points) == 0: return None
-    if len(points) == 1:
-        path = BezierPath(None)
-        path.moveto(points[0].x, points[0].y)
+    xs, ys = _coordinates(points)
+    n = len(xs)
+    if closed and n > 1 and xs[0] == xs[-1] and ys[0] == ys[-1]:
+        # The loop closes by itself, the last point is the first one.
+        n -= 1
+        xs, ys = xs[:n], ys[:n]
+
+    if n == 0: return None
+    path = BezierPath(None)
+    path.moveto(xs[0], ys[0])
+    if n == 1:
         return path
-    if len(points) == 2:
-        path = BezierPath(None)
-        path.moveto(points[0].x, points[0].y)
-        path.lineto(points[1].x, points[1].y)
+    if n == 2:
+        path.lineto(xs[1], ys[1])
+        if closed: path.closepath()
         return path
               
     # Zero curvature means straight lines.
     
     curvature = max(0, min(1, curvature))
     if curvature == 0:
-        path = BezierPath(None)
-        path.moveto(points[0].x, points[0].y)
-        for i in range(len(points)): 
-            path.lineto(points[i].x, points[i].y)
+        if closed:
+            for i in xrange(1, n):
+                path.lineto(xs[i], ys[i])
+            path.closepath()
+        else:
+            for i in xrange(n):
+                path.lineto(xs[i], ys[i])
         return path
         
     curvature = 4 + (1.0-curvature)*40
+
+    if closed:
+        dx, dy = _cyclic_tangents(xs, ys, curvature)
+    else:
+        dx, dy = _tangents(xs, ys, curvature)
+
+    curveto = path.curveto
+    for i in xrange(n-1):
+        curveto(xs[i] + dx[i], ys[i] + dy[i],
+                xs[i+1] - dx[i+1], ys[i+1] - dy[i+1],
+                xs[i+1], ys[i+1])
+    if closed:
+        curveto(xs[-1] + dx[-1], ys[-1] + dy[-1],
+                xs[0] - dx[0], ys[0] - dy[0],
+                xs[0], ys[0])
+        path.closepath()
     
-    dx = {0: 0, len(points)-1: 0}
-    dy = {0: 0, len(points)-1: 0}
-    bi = {1: -0.25}
-    ax = {1: (points[2].x-points[0].x-dx[0]) / 4}
-    ay = {1: (points[2].y-points[0].y-dy[0]) / 4}
-    
-    for i in range(2, len(points)-1):
-        bi[i] = -1 / (curvature + bi[i-1])
-        ax[i] = -(points[i+1].x-points[i-1].x-ax[i-1]) * bi[i]
-        ay[i] = -(points[i+1].y-points[i-1].y-ay[i-1]) * bi[i]
-        
-    r = range(1, len(points)-1)
-    r.reverse()
-    for i in r:
+    return path
+
+def _coordinates(points):
+    """Returns the x and y coordinates of the points as two arrays.
+    Accepts Point objects, (x, y)-tuples or a flat sequence of numbers."""
+    if len(points) > 0 and isinstance(points[0], (int, long, float)):
+        if len(points) % 2 != 0:
+            raise NodeBoxError, "A flat list of coordinates should have an even length"
+        return array('d', points[0::2]), array('d', points[1::2])
+    xs = array('d')
+    ys = array('d')
+    for pt in points:
+        if isinstance(pt, Point):
+            xs.append(pt.x)
+            ys.append(pt.y)
+        else:
+            xs.append(pt[0])
+            ys.append(pt[1])
+    return xs, ys
+
+def _tangents(xs, ys, curvature):
+
+    """Solves the tangents at the points of an open path.
+
+    Each inner tangent d[i] satisfies
+    d[i-1] + curvature * d[i] + d[i+1] = p[i+1] - p[i-1],
+    the tangents at both ends are zero. The system is
+    tridiagonal, so the Thomas algorithm solves it in linear time.
+    """
+
+    n = len(xs)
+    dx = array('d', [0.0]) * n
+    dy = array('d', [0.0]) * n
+    bi = array('d', [0.0]) * n
+    ax = array('d', [0.0]) * n
+    ay = array('d', [0.0]) * n
+
+    bi[1] = -0.25
+    ax[1] = (xs[2] - xs[0]) / 4
+    ay[1] = (ys[2] - ys[0]) / 4
+    for i in xrange(2, n-1):
+        bi[i] = b = -1 / (curvature + bi[i-1])
+        ax[i] = -(xs[i+1] - xs[i-1] - ax[i-1]) * b
+        ay[i] = -(ys[i+1] - ys[i-1] - ay[i-1]) * b
+
+    for i in xrange(n-2, 0, -1):
         dx[i] = ax[i] + dx[i+1] * bi[i]
         dy[i] = ay[i] + dy[i+1] * bi[i]
+    return dx, dy
 
-    path = BezierPath(None)
-    path.moveto(points[0].x, points[0].y)
-    for i in range(len(points)-1):
-        path.curveto(points[i].x + dx[i], 
-                     points[i].y + dy[i],
-                     points[i+1].x - dx[i+1], 
-                     points[i+1].y - dy[i+1],
-                     points[i+1].x,
-                     points[i+1].y)
-    
-    return path
+def _cyclic_tangents(xs, ys, curvature):
+
+    """Solves the tangents at the points of a closed path.
+
+    Every tangent satisfies d[i-1] + curvature * d[i] + d[i+1] = p[i+1] - p[i-1],
+    with indices wrapping around. The corners this adds to the
+    tridiagonal matrix are handled with the Sherman-Morrison formula:
+    the Thomas algorithm solves a tridiagonal system for x, y
+    and a correction vector, which are then combined.
+    """
+
+    n = len(xs)
+    gamma = -curvature
+    diag = array('d', [curvature]) * n
+    diag[0] = curvature - gamma
+    diag[-1] = curvature - 1 / gamma
+
+    # Forward sweep, shared by the three right-hand sides.
+    cp = array('d', [0.0]) * n
+    rx = array('d', [0.0]) * n
+    ry = array('d', [0.0]) * n
+    ru = array('d', [0.0]) * n
+    m = diag[0]
+    cp[0] = 1 / m
+    rx[0] = (xs[1] - xs[-1]) / m
+    ry[0] = (ys[1] - ys[-1]) / m
+    ru[0] = gamma / m
+    for i in xrange(1, n):
+        m = diag[i] - cp[i-1]
+        cp[i] = 1 / m
+        j = (i+1) % n
+        rx[i] = (xs[j] - xs[i-1] - rx[i-1]) / m
+        ry[i] = (ys[j] - ys[i-1] - ry[i-1]) / m
+        ru[i] = -ru[i-1] / m
+    ru[-1] += 1 / m
+
+    # Back substitution.
+    for i in xrange(n-2, -1, -1):
+        rx[i] -= cp[i] * rx[i+1]
+        ry[i] -= cp[i] * ry[i+1]
+        ru[i] -= cp[i] * ru[i+1]
+
+    # Sherman-Morrison correction.
+    denominator = 1 + ru[0] + ru[-1] / gamma
+    fx = (rx[0] + rx[-1] / gamma) / denominator
+    fy = (ry[0] + ry[-1] / gamma) / denominator
+    for i in xrange(n):
+        rx[i] -= fx * ru[i]
+        ry[i] -= fy * ru[i]
+    return rx, ry
 
 def insert_point(path, t):
     
@@ -390,11 +851,6 @@ def insert_point(path, t):
     Traceback (most recent call last):
         ...
     NodeBoxError: The given path is empty
-    >>> path.moveto(0, 0)
-    >>> insert_point(path, 0.2)
-    Traceback (most recent call last):
-        ...
-    NodeBoxError: The given path is empty
     >>> path.lineto(100, 50)
     >>> len(path)
     2
@@ -402,68 +858,442 @@ def insert_point(path, t):
     >>> len(path)
     3
     >>> path[1]
-    PathElement(LINETO, ((50.0, 25.0),))
+    PathElement(LINETO, ((50.000, 25.000),))
     >>> path = BezierPath(None)
     >>> path.moveto(0, 100)
     >>> path.curveto(0, 50, 100, 50, 100, 100)
     >>> path = insert_point(path, 0.5)
     >>> path[1]
-    PathElement(LINETO, ((25.0, 62.5), (0.0, 75.0), (50.0, 62.5))
+    PathElement(CURVETO, ((0.000, 75.000), (25.000, 62.5), (50.000, 62.500))
     """
     
-    i, t, closeto = _locate(path, t)
-    
-    x0 = path[i].x
-    y0 = path[i].y
-    p1 = path[i+1]
-    p1cmd, x3, y3, x1, y1, x2, y2 = p1.cmd, p1.x, p1.y, p1.ctrl1.x, p1.ctrl1.y, p1.ctrl2.x, p1.ctrl2.y
-    
-    if p1cmd == CLOSE:
-        pt_cmd = LINETO
-        pt_x, pt_y = linepoint(t, x0, y0, closeto.x, closeto.y)
-    elif p1cmd == LINETO:
-        pt_cmd = LINETO
-        pt_x, pt_y = linepoint(t, x0, y0, x3, y3)
-    elif p1cmd == CURVETO:
-        pt_cmd = CURVETO
-        pt_x, pt_y, pt_c1x, pt_c1y, pt_c2x, pt_c2y, pt_h1x, pt_h1y, pt_h2x, pt_h2y = \
-            curvepoint(t, x0, y0, x1, y1, x2, y2, x3, y3, True)
-    else:
-        raise NodeBoxError, "Locate should not return a MOVETO"
-    
+    return insert_points(path, [t])
+
+def insert_points(path, ts):
+
+    """Returns a path copy with an extra point at each of the t values.
+
+    All segments are split in a single pass over the path,
+    so this is much faster than calling insert_point() for each t.
+    A curve that gets several points is split at each of them in turn,
+    with the same handles insert_point() would give.
+
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.lineto(100, 0)
+    >>> path.lineto(100, 100)
+    >>> path = insert_points(path, [0.75, 0.25, 0.125])
+    >>> len(path)
+    6
+    >>> path[1], path[2], path[4]
+    (PathElement(LINETO, ((25.000, 0.000),)), PathElement(LINETO, ((50.000, 0.000),)), PathElement(LINETO, ((100.000, 50.000),)))
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 100)
+    >>> path.curveto(0, 50, 100, 50, 100, 100)
+    >>> path = insert_points(path, [0.5, 0.25])
+    >>> len(path)
+    4
+    >>> path[2]
+    PathElement(CURVETO, ((25.000, 65.625), (37.500, 62.5), (50.000, 62.500))
+    >>> path[3]
+    PathElement(CURVETO, ((75.000, 62.500), (100.000, 75.0), (100.000, 100.000))
+    """
+
+    splits = {}
+    for i, segment_ts, closeto in _locate_batch(path, sorted(ts)):
+        splits[i+1] = (segment_ts, closeto)
+
     new_path = BezierPath(None)
-    new_path.moveto(path[0].x, path[0].y)
-    for j in range(1, len(path)):
-        if j == i+1:
-            if pt_cmd == CURVETO:
-                new_path.curveto(pt_h1x, pt_h1y,
-                             pt_c1x, pt_c1y,
-                             pt_x, pt_y)
-                new_path.curveto(pt_c2x, pt_c2y,
-                             pt_h2x, pt_h2y,
-                             path[j].x, path[j].y)
-            elif pt_cmd == LINETO:
-                new_path.lineto(pt_x, pt_y)
-                if path[j].cmd != CLOSE:
-                    new_path.lineto(path[j].x, path[j].y)
+    x0 = y0 = 0.0
+    for j, (cmd, ex, ey, ex1, ey1, ex2, ey2) in enumerate(path.iter_segments()):
+        if j in splits:
+            segment_ts, closeto = splits[j]
+            if cmd == CURVETO:
+                x1, y1, x2, y2, x3, y3 = ex1, ey1, ex2, ey2, ex, ey
+                previous = 0.0
+                for t in segment_ts:
+                    # Split what is left of the curve, which starts at the previous t.
+                    if previous < 1.0:
+                        local_t = (t - previous) / (1.0 - previous)
+                    else:
+                        local_t = 1.0
+                    x, y, c1x, c1y, c2x, c2y, h1x, h1y, h2x, h2y = \
+                        curvepoint(local_t, x0, y0, x1, y1, x2, y2, x3, y3, True)
+                    new_path.curveto(h1x, h1y, c1x, c1y, x, y)
+                    x0, y0, x1, y1, x2, y2 = x, y, c2x, c2y, h2x, h2y
+                    previous = t
+                new_path.curveto(x1, y1, x2, y2, x3, y3)
+            elif cmd == LINETO or cmd == CLOSE:
+                if cmd == CLOSE:
+                    x3, y3 = closeto.x, closeto.y
                 else:
+                    x3, y3 = ex, ey
+                for t in segment_ts:
+                    new_path.lineto(*linepoint(t, x0, y0, x3, y3))
+                if cmd == CLOSE:
                     new_path.closepath()
+                else:
+                    new_path.lineto(x3, y3)
             else:
-                raise NodeBoxError, "Didn't expect pt_cmd %s here" % pt_cmd
-            
+                raise NodeBoxError, "Locate should not return a MOVETO"
+        elif cmd == MOVETO:
+            new_path.moveto(ex, ey)
+        elif cmd == LINETO:
+            new_path.lineto(ex, ey)
+        elif cmd == CURVETO:
+            new_path.curveto(ex1, ey1, ex2, ey2, ex, ey)
+        elif cmd == CLOSE:
+            new_path.closepath()
+        elif cmd == RECT:
+            new_path.rect(ex, ey, ex1, ey1)
+        if cmd == MOVETO:
+            start_x, start_y = ex, ey
+        if cmd == CLOSE:
+            x0, y0 = start_x, start_y
         else:
-            if path[j].cmd == MOVETO:
-                new_path.moveto(path[j].x, path[j].y)
-            if path[j].cmd == LINETO:
-                new_path.lineto(path[j].x, path[j].y)
-            if path[j].cmd == CURVETO:
-                new_path.curveto(path[j].ctrl1.x, path[j].ctrl1.y,
-                             path[j].ctrl2.x, path[j].ctrl2.y,
-                             path[j].x, path[j].y)
-            if path[j].cmd == CLOSE:
-                new_path.closepath()
+            x0, y0 = ex, ey
     return new_path
     
+def simplify(path, tolerance=FLATNESS):
+
+    """Returns a copy of the path with fewer elements,
+    that is never more than tolerance away from the path.
+
+    Runs of lines are thinned with the Ramer-Douglas-Peucker algorithm.
+    Runs of curves that join smoothly are replaced by as few curves
+    as fit them, with the least-squares fit of Philip J. Schneider's
+    "An Algorithm for Automatically Fitting Digitized Curves".
+    Corners, MOVETO, CLOSE and RECT elements are kept as they are.
+    The default tolerance is the one Cairo draws curves with,
+    so the difference is not visible.
+
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> for i in range(1, 101):
+    ...     path.lineto(i, i % 2 * 0.01)
+    >>> path.lineto(100, 100)
+    >>> len(simplify(path))
+    3
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.curveto(0, 50, 50, 100, 100, 100)
+    >>> path = insert_points(path, [0.2, 0.4, 0.6, 0.8])
+    >>> len(path), len(simplify(path))
+    (6, 2)
+
+    Curves that were split are merged again:
+    >>> path = findpath([(0, 0), (40, 60), (80, 20), (120, 80), (160, 0)])
+    >>> path = insert_points(path, [0.1, 0.3, 0.5, 0.7, 0.9])
+    >>> len(path), len(simplify(path))
+    (10, 5)
+    """
+
+    if tolerance <= 0:
+        raise NodeBoxError, "The tolerance should be larger than zero"
+
+    new_path = BezierPath(None)
+    run_cmd = None
+    run = []
+    x0 = y0 = start_x = start_y = 0.0
+
+    for cmd, x, y, x1, y1, x2, y2 in path.iter_segments():
+        if cmd != run_cmd or (cmd == CURVETO and not _smooth(run[-1], x1, y1)):
+            _simplify_run(new_path, run_cmd, run, x0, y0, tolerance)
+            if run:
+                x0, y0 = run[-1][-2:]
+            run = []
+            run_cmd = cmd
+        if cmd == LINETO:
+            run.append((x, y))
+        elif cmd == CURVETO:
+            run.append((x1, y1, x2, y2, x, y))
+        else:
+            run_cmd = None
+            if cmd == MOVETO:
+                new_path.moveto(x, y)
+                x0, y0 = start_x, start_y = x, y
+            elif cmd == CLOSE:
+                new_path.closepath()
+                x0, y0 = start_x, start_y
+            elif cmd == RECT:
+                new_path.rect(x, y, x1, y1)
+                x0, y0 = start_x, start_y = x, y
+    _simplify_run(new_path, run_cmd, run, x0, y0, tolerance)
+    return new_path
+
+def _smooth(curve, x1, y1):
+    """Returns True if the next curve, with its first control point at (x1, y1),
+    leaves the end of this curve in the direction it arrived."""
+    c2x, c2y, x, y = curve[-4:]
+    ax, ay = x - c2x, y - c2y
+    bx, by = x1 - x, y1 - y
+    la = sqrt(ax*ax + ay*ay)
+    lb = sqrt(bx*bx + by*by)
+    if la == 0 or lb == 0:
+        return False
+    # Within about a tenth of a degree.
+    return (ax*bx + ay*by) / (la*lb) > 0.999998
+
+def _simplify_run(path, cmd, run, x0, y0, tolerance):
+    """Appends a simplified run of LINETOs or smoothly joined CURVETOs
+    that starts at (x0, y0) to the path."""
+    if not run:
+        return
+    if cmd == LINETO:
+        xs = [x0] + [pt[0] for pt in run]
+        ys = [y0] + [pt[1] for pt in run]
+        for i in _rdp(xs, ys, tolerance)[1:]:
+            path.lineto(xs[i], ys[i])
+        return
+
+    curves = run
+    if len(run) > 1:
+        # The samples lie within a quarter of the tolerance of the curves,
+        # the fit within three quarters of the samples.
+        xs, ys = [x0], [y0]
+        starts, joints, params = [], [0], []
+        px, py = x0, y0
+        for x1, y1, x2, y2, x3, y3 in run:
+            n = max(4, curvesteps(px, py, x1, y1, x2, y2, x3, y3, tolerance * 0.25))
+            coords = curvepoints([1.0 * i / n for i in xrange(1, n)], px, py, x1, y1, x2, y2, x3, y3)
+            xs.extend(coords[0::2])
+            ys.extend(coords[1::2])
+            xs.append(x3)
+            ys.append(y3)
+            starts.append((px, py))
+            joints.append(len(xs) - 1)
+            params.append([1.0 * i / n for i in xrange(n + 1)])
+            px, py = x3, y3
+        first, last = run[0], run[-1]
+        tan1 = _normalize(first[0] - x0, first[1] - y0, first[4] - x0, first[5] - y0)
+        tan2 = _normalize(last[2] - last[4], last[3] - last[5], x0 - last[4], y0 - last[5])
+        fitted = []
+        _fitcurves(xs, ys, tan1, tan2, tolerance * 0.75, fitted)
+        if len(fitted) > 1:
+            curves = _merge_curves(run, starts, xs, ys, joints, params, tolerance * 0.75)
+        if len(fitted) < len(curves):
+            curves = fitted
+    for x1, y1, x2, y2, x3, y3 in curves:
+        path.curveto(x1, y1, x2, y2, x3, y3)
+
+def _merge_curves(run, starts, xs, ys, joints, params, error):
+    """Returns the run with neighbouring curves merged, as long as one curve
+    comes within error of their points.
+
+    Splitting a fit where it misses most cuts a run anywhere but at its
+    joints, so it doesn't find the curves that insert_points() split.
+    Each curve is merged with the next as the curve they could have been
+    split from, or else as the curve that fits both best.
+    """
+    curves = []
+    i = 0
+    while i < len(run):
+        merged, u = run[i], params[i]
+        x0, y0 = starts[i]
+        j = i + 1
+        while j < len(run):
+            a, b = joints[i], joints[j+1] + 1
+            curve, t = _unsplit(x0, y0, merged, run[j])
+            if t is not None:
+                v = [s * t for s in u] + [t + (1 - t) * s for s in params[j][1:]]
+                if _fiterror(xs[a:b], ys[a:b], v, curve)[0] <= error * error:
+                    merged, u = curve, v
+                    j += 1
+                    continue
+            curve = run[j]
+            tan1 = _normalize(merged[0] - x0, merged[1] - y0, merged[4] - x0, merged[5] - y0)
+            tan2 = _normalize(curve[2] - curve[4], curve[3] - curve[5], curve[0] - curve[4], curve[1] - curve[5])
+            curve, v, split = _fit(xs[a:b], ys[a:b], tan1, tan2, error)
+            if split is not None:
+                break
+            merged, u = curve, v
+            j += 1
+        curves.append(merged)
+        i = j
+    return curves
+
+def _unsplit(x0, y0, curve, next):
+    """Returns the curve from (x0, y0) that splitting at t gives the two curves,
+    and t, if they join smoothly. The reverse of insert_point().
+
+    >>> _unsplit(0, 0, (0.0, 5.0, 0.0, 7.5, 3.0, 8.25), (6.0, 9.0, 9.0, 10.0, 10.0, 10.0))
+    ((0.0, 10.0, 8.0, 10.0, 10.0, 10.0), 0.5)
+    """
+    x1, y1, x2, y2, x3, y3 = curve
+    x4, y4, x5, y5, x6, y6 = next
+    d1 = sqrt((x3-x2)**2 + (y3-y2)**2)
+    d2 = sqrt((x4-x3)**2 + (y4-y3)**2)
+    if d1 == 0 or d2 == 0:
+        return None, None
+    t = d1 / (d1 + d2)
+    return (x0 + (x1-x0) / t, y0 + (y1-y0) / t,
+            x6 + (x5-x6) / (1-t), y6 + (y5-y6) / (1-t), x6, y6), t
+
+def _rdp(xs, ys, tolerance):
+    """Returns the indices of the points the Ramer-Douglas-Peucker algorithm keeps:
+    the fewest points such that the polyline through them stays within tolerance
+    of all the others."""
+    n = len(xs)
+    keep = [False] * n
+    keep[0] = keep[n-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        dd = dx*dx + dy*dy
+        worst = 0.0
+        index = None
+        for i in xrange(first+1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            # The squared distance to the segment, not the infinite line.
+            if dd == 0:
+                d = px*px + py*py
+            else:
+                t = (px*dx + py*dy) / dd
+                if t < 0: t = 0.0
+                elif t > 1: t = 1.0
+                ex, ey = px - t*dx, py - t*dy
+                d = ex*ex + ey*ey
+            if d > worst:
+                worst, index = d, i
+        if index is not None and worst > tolerance * tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i in xrange(n) if keep[i]]
+
+def _normalize(x, y, fallback_x=0.0, fallback_y=0.0):
+    """Returns (x, y) scaled to a length of one,
+    or the fallback direction if (x, y) has no length."""
+    d = sqrt(x*x + y*y)
+    if d == 0:
+        x, y = fallback_x, fallback_y
+        d = sqrt(x*x + y*y)
+        if d == 0:
+            return (0.0, 0.0)
+    return (x / d, y / d)
+
+def _fitcurves(xs, ys, tan1, tan2, error, out):
+
+    """Fits curves through the points, appending (x1, y1, x2, y2, x3, y3)
+    for each of them to out.
+
+    The curve leaves the first point in the direction of tan1,
+    and arrives at the last point from the direction of tan2.
+    If a single curve doesn't come within error of all points,
+    the points are split where it misses most, and both halves are fitted.
+    """
+
+    curve, u, split = _fit(xs, ys, tan1, tan2, error)
+    if split is None:
+        out.append(curve)
+        return
+
+    center = _normalize(xs[split-1] - xs[split+1], ys[split-1] - ys[split+1],
+                        xs[split-1] - xs[split], ys[split-1] - ys[split])
+    _fitcurves(xs[:split+1], ys[:split+1], tan1, center, error, out)
+    _fitcurves(xs[split:], ys[split:], (-center[0], -center[1]), tan2, error, out)
+
+def _fit(xs, ys, tan1, tan2, error):
+    """Fits one curve through the points. Returns the curve, the parameters
+    of the points on it, and None if it comes within error of all points,
+    or else the index of the point it misses most."""
+    n = len(xs)
+    x0, y0, x3, y3 = xs[0], ys[0], xs[-1], ys[-1]
+    if n == 2:
+        d = sqrt((x3-x0)**2 + (y3-y0)**2) / 3
+        return (x0 + tan1[0]*d, y0 + tan1[1]*d, x3 + tan2[0]*d, y3 + tan2[1]*d, x3, y3), [0.0, 1.0], None
+
+    # Chord-length parameterization.
+    u = [0.0] * n
+    for i in xrange(1, n):
+        u[i] = u[i-1] + sqrt((xs[i]-xs[i-1])**2 + (ys[i]-ys[i-1])**2)
+    total = u[-1]
+    if total == 0:
+        return (x0, y0, x3, y3, x3, y3), u, None
+    u = [v / total for v in u]
+
+    curve = _fitcurve(xs, ys, u, tan1, tan2)
+    worst, split = _fiterror(xs, ys, u, curve)
+    if worst > error * error:
+        # A better parameterization is often all it takes.
+        for i in xrange(4):
+            u = _reparameterize(xs, ys, u, curve)
+            curve = _fitcurve(xs, ys, u, tan1, tan2)
+            worst, split = _fiterror(xs, ys, u, curve)
+            if worst <= error * error:
+                break
+    if worst <= error * error:
+        return curve, u, None
+    return curve, u, split
+
+def _fitcurve(xs, ys, u, tan1, tan2):
+    """Returns the curve with the given end points and tangents that fits
+    the points at the parameters u best, in the least-squares sense."""
+    x0, y0, x3, y3 = xs[0], ys[0], xs[-1], ys[-1]
+    c00 = c01 = c11 = r0 = r1 = 0.0
+    for i in xrange(len(xs)):
+        t = u[i]
+        mt = 1 - t
+        b0, b1, b2, b3 = mt*mt*mt, 3*t*mt*mt, 3*t*t*mt, t*t*t
+        a0x, a0y = tan1[0]*b1, tan1[1]*b1
+        a1x, a1y = tan2[0]*b2, tan2[1]*b2
+        c00 += a0x*a0x + a0y*a0y
+        c01 += a0x*a1x + a0y*a1y
+        c11 += a1x*a1x + a1y*a1y
+        dx = xs[i] - (x0*(b0+b1) + x3*(b2+b3))
+        dy = ys[i] - (y0*(b0+b1) + y3*(b2+b3))
+        r0 += a0x*dx + a0y*dy
+        r1 += a1x*dx + a1y*dy
+    det = c00*c11 - c01*c01
+    chord = sqrt((x3-x0)**2 + (y3-y0)**2)
+    epsilon = 1e-6 * chord
+    if det != 0:
+        alpha1 = (r0*c11 - r1*c01) / det
+        alpha2 = (c00*r1 - c01*r0) / det
+    if det == 0 or alpha1 < epsilon or alpha2 < epsilon:
+        # No usable solution: fall back on handles a third of the chord long.
+        alpha1 = alpha2 = chord / 3
+    return (x0 + tan1[0]*alpha1, y0 + tan1[1]*alpha1,
+            x3 + tan2[0]*alpha2, y3 + tan2[1]*alpha2, x3, y3)
+
+def _fiterror(xs, ys, u, curve):
+    """Returns the largest squared distance between a point
+    and the curve at its parameter, and the index of that point."""
+    x0, y0 = xs[0], ys[0]
+    x1, y1, x2, y2, x3, y3 = curve
+    worst = 0.0
+    split = len(xs) // 2
+    for i in xrange(1, len(xs)-1):
+        x, y = curvepoint(u[i], x0, y0, x1, y1, x2, y2, x3, y3)[:2]
+        d = (x - xs[i])**2 + (y - ys[i])**2
+        if d > worst:
+            worst, split = d, i
+    return worst, split
+
+def _reparameterize(xs, ys, u, curve):
+    """Moves each parameter closer to where the curve is nearest to its point,
+    with a step of Newton's method."""
+    x0, y0 = xs[0], ys[0]
+    x1, y1, x2, y2, x3, y3 = curve
+    # The first and second derivatives as polynomials.
+    ax, bx, cx = 3*(x3 - 3*x2 + 3*x1 - x0), 6*(x2 - 2*x1 + x0), 3*(x1 - x0)
+    ay, by, cy = 3*(y3 - 3*y2 + 3*y1 - y0), 6*(y2 - 2*y1 + y0), 3*(y1 - y0)
+    result = []
+    for i in xrange(len(xs)):
+        t = u[i]
+        x, y = curvepoint(t, x0, y0, x1, y1, x2, y2, x3, y3)[:2]
+        dx, dy = (ax*t + bx)*t + cx, (ay*t + by)*t + cy
+        ddx, ddy = 2*ax*t + bx, 2*ay*t + by
+        ex, ey = x - xs[i], y - ys[i]
+        denominator = dx*dx + dy*dy + ex*ddx + ey*ddy
+        if denominator != 0:
+            t -= (ex*dx + ey*dy) / denominator
+            t = min(1.0, max(0.0, t))
+        result.append(t)
+    return result
+
 def _test():
     import doctest, bezier
     return doctest.testmod(bezier)
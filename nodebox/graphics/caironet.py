@@ -2,6 +2,11 @@ import nodebox.util.os as os
 import nodebox.util.color as colorlib
 from nodebox.util import _copy_attr, _copy_attrs
 from math import pi, tan, sqrt
+from array import array
+from itertools import izip
+import re, threading
+
+from nodebox.graphics import geometrycache
 
 import sys, clr
 sys.path.append(os.path.join(os.getcwd(), "cairo.net"))
@@ -72,10 +77,37 @@ _STATE_NAMES = {
 
 KAPPA = 4 * (sqrt(2) - 1) / 3
 
+# The maximum error when measuring the length of a curve.
+LENGTH_TOLERANCE = 0.01
+
+# The maximum distance between a curve and the lines that replace it
+# when flattening a path, the same as Cairo's default tolerance.
+FLATNESS = 0.1
+
+# Cairo's default miter limit lets joins reach this many
+# stroke widths away from the path.
+MITER_REACH = 5.0
+
+# How BezierPath.from_commands() reads the coordinates of each command:
+# how many numbers it takes, and which of them go into the six numbers
+# stored for an element. None stores a zero.
+_COMMAND_LAYOUT = {
+    MOVETO:  (2, (0, 1, 0, 1, 0, 1)),
+    LINETO:  (2, (0, 1, 0, 1, 0, 1)),
+    CURVETO: (6, (4, 5, 0, 1, 2, 3)),
+    CLOSE:   (0, (None, None, None, None, None, None)),
+    RECT:    (4, (0, 1, 2, 3, None, None)),
+}
+
+# Matches a run of the same command in a string of commands.
+_COMMAND_RUN = re.compile(r'(.)\1*', re.S)
+
 class NodeBoxError(Exception): pass
 
 class Point(object):
 
+    __slots__ = ('x', 'y')
+
     def __init__(self, *args):
         if len(args) == 2:
             self.x, self.y = args
@@ -96,10 +128,21 @@ class Point(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        # Points are mutable: don't change one that is used as a key.
+        return hash((self.x, self.y))
+
 
 class Grob(object):
     """A GRaphic OBject is the base class for all DrawingPrimitives."""
 
+    # True when the style attributes are shared with a copy of the grob,
+    # or with other grobs through a Style.
+    _style_shared = False
+
+    # The Style the style attributes came from, if any.
+    _style = None
+
     def __init__(self, ctx):
         """Initializes this object with the current context."""
         self._ctx = ctx
@@ -107,19 +150,42 @@ class Grob(object):
     def draw(self):
         """Appends the grob to the canvas.
            This will result in a draw later on, when the scene graph is rendered."""
-        # XXX this kind of sucks, making a copy every time an element is drawn
-        # need to come up with a better way of capturing context state
+        # The canvas needs a snapshot of the grob as it is now. For paths
+        # this is cheap: the copy shares the geometry and style until
+        # either of them changes.
         self._ctx.canvas.append(self.copy())
         # print "draw called with transform: "+str(self._transform)
         
     def copy(self):
         """Returns a deep copy of this grob."""
         raise NotImplementedError, "Copy is not implemented on this Grob class."
+
+    def _paint_bounds(self):
+        """Returns the box (left, top, right, bottom) the grob paints in
+        when it is drawn, or None if that isn't known."""
+        return None
         
+    def _own_style(self):
+        """Gives the grob its own copy of the style attributes it shares
+        with a copy. Called before they can be changed in place."""
+        if self._style_shared:
+            _copy_attrs(self, self, self.stateAttributes)
+            self._style_shared = False
+            self._style = None
+
     def inheritFromContext(self, ignore=()):
         attrs_to_copy = list(self.__class__.stateAttributes)
         [attrs_to_copy.remove(k) for k, v in _STATE_NAMES.items() if v in ignore]
-        _copy_attrs(self._ctx, self, attrs_to_copy)
+        # Grobs drawn in the same state share its Style by reference,
+        # instead of copying its colors and transform.
+        style = self._ctx._style()
+        shared = [attr for attr in attrs_to_copy if attr in Style.attributes]
+        for attr in shared:
+            setattr(self, attr, getattr(style, attr))
+        if shared:
+            self._style = style
+            self._style_shared = True
+        _copy_attrs(self._ctx, self, [attr for attr in attrs_to_copy if attr not in shared])
         
     def checkKwargs(self, kwargs):
         remaining = [arg for arg in kwargs.keys() if arg not in self.kwargs]
@@ -127,6 +193,38 @@ class Grob(object):
             raise NodeBoxError, "Unknown argument(s) '%s'" % ", ".join(remaining)
     checkKwargs = classmethod(checkKwargs)
 
+class Style(object):
+
+    """An immutable record of the style a grob takes from the context:
+    its fill, stroke, strokewidth, transform and transformmode.
+
+    The context interns them: all grobs drawn in the same state share
+    one Style, and the colors and transform in it. Neither the Style nor
+    those objects may change; a grob copies them before it changes its
+    style, see Grob._own_style().
+    """
+
+    __slots__ = ('_fillcolor', '_strokecolor', '_strokewidth', '_transform',
+                 '_transformmode', '__weakref__')
+
+    attributes = ('_fillcolor', '_strokecolor', '_strokewidth', '_transform', '_transformmode')
+
+    def __init__(self, fill, stroke, strokewidth, transform, transformmode):
+        self._fillcolor = _copy_attr(fill)
+        self._strokecolor = _copy_attr(stroke)
+        self._strokewidth = strokewidth
+        self._transform = _copy_attr(transform)
+        self._transformmode = transformmode
+
+    def key(cls, fill, stroke, strokewidth, transform, transformmode):
+        """Returns the key a Style with these values is interned with."""
+        if fill is not None:
+            fill = fill._components()
+        if stroke is not None:
+            stroke = stroke._components()
+        return (fill, stroke, strokewidth, tuple(transform), transformmode)
+    key = classmethod(key)
+
 class TransformMixin(object):
 
     """Mixin class for transformation support.
@@ -140,6 +238,7 @@ class TransformMixin(object):
         self._transformmode = CENTER
         
     def _get_transform(self):
+        self._own_style()
         return self._transform
     def _set_transform(self, transform):
         self._transform = Transform(self._ctx, transform)
@@ -152,21 +251,26 @@ class TransformMixin(object):
     transformmode = property(_get_transformmode, _set_transformmode)
         
     def translate(self, x, y):
+        self._own_style()
         self._transform.translate(x, y)
         
     def reset(self):
         self._transform = Transform(self._ctx)
 
     def rotate(self, degrees=0, radians=0):
+        self._own_style()
         self._transform.rotate(-degrees,-radians)
 
     def translate(self, x=0, y=0):
+        self._own_style()
         self._transform.translate(x,y)
 
     def scale(self, x=1, y=None):
+        self._own_style()
         self._transform.scale(x,y)
 
     def skew(self, x=0, y=0):
+        self._own_style()
         self._transform.skew(x,y)
         
 class ColorMixin(object):
@@ -188,12 +292,14 @@ class ColorMixin(object):
         self._strokewidth = kwargs.get('strokewidth', 1.0)
         
     def _get_fill(self):
+        self._own_style()
         return self._fillcolor
     def _set_fill(self, *args):
         self._fillcolor = Color(self._ctx, *args)
     fill = property(_get_fill, _set_fill)
     
     def _get_stroke(self):
+        self._own_style()
         return self._strokecolor
     def _set_stroke(self, *args):
         self._strokecolor = Color(self._ctx, *args)
@@ -206,86 +312,196 @@ class ColorMixin(object):
     strokewidth = property(_get_strokewidth, _set_strokewidth)
 
 class BezierPath(Grob, TransformMixin, ColorMixin):
-    """A BezierPath """
+    """A BezierPath 
+
+    The path is stored as an array of commands and an array of
+    coordinates with six numbers per element: x, y, ctrl1.x, ctrl1.y,
+    ctrl2.x and ctrl2.y, laid out the same way as a PathElement.
+    PathElement objects are only made when the path is indexed or iterated.
+
+    Copies are copy-on-write: a copy shares the storage, the cached
+    geometry and the style of the original until either of them changes.
+    """
     
     stateAttributes = ('_fillcolor', '_strokecolor', '_strokewidth', '_transform', '_transformmode')
     kwargs = ('fill', 'stroke', 'strokewidth')
 
     def __init__(self, ctx, path=None, **kwargs):
         super(BezierPath, self).__init__(ctx)
+
+        self._geometry = None
+        self._version = 0
+        self._shared = False
+        if isinstance(path, BezierPath):
+            self._share(path)
+            return
+
         TransformMixin.__init__(self)
         ColorMixin.__init__(self, **kwargs)
-
-        self._segment_cache = None
         if path is None:
-            self._elements = []
+            self._cmds = array('B')
+            self._coords = array('d')
         elif isinstance(path, (list,tuple)):
-            self._elements = []
+            self._cmds = array('B')
+            self._coords = array('d')
             self.extend(path)
-        elif isinstance(path, BezierPath):
-            # XXX yeah yeah this sucks
-            self._elements = []
-            for p in path._elements:
-                self._elements.append(p)
-            _copy_attrs(path, self, self.stateAttributes)
         else:
             raise NodeBoxError, "Don't know what to do with %s." % path
             
     def copy(self):
         return self.__class__(self._ctx, self)
 
+    def from_commands(cls, ctx, cmds, coords, **kwargs):
+        """Makes a path from a sequence of commands and a flat sequence
+        of their coordinates, in the order the path methods take them:
+        x, y for MOVETO and LINETO, x1, y1, x2, y2, x3, y3 for CURVETO,
+        x, y, width, height for RECT and nothing for CLOSE.
+
+        The coordinates can be any sequence of numbers, or an array.
+        Runs of the same command are converted at once, so long paths
+        are built without a method call per point."""
+        path = cls(ctx, **kwargs)
+        path._append_commands(cmds, coords)
+        return path
+    from_commands = classmethod(from_commands)
+
+    def from_polyline(cls, ctx, coords, closed=False, **kwargs):
+        """Makes a path of lines through a flat sequence of coordinates:
+        x, y, x, y, ... The path is closed when closed is True."""
+        coords = _as_array('d', coords)
+        if len(coords) % 2 != 0:
+            raise NodeBoxError, "The coordinates should come in pairs"
+        amount = len(coords) // 2
+        if amount == 0:
+            return cls(ctx, **kwargs)
+        cmds = array('B', [MOVETO]) + array('B', [LINETO]) * (amount-1)
+        if closed:
+            cmds.append(CLOSE)
+        return cls.from_commands(ctx, cmds, coords, **kwargs)
+    from_polyline = classmethod(from_polyline)
+
+    def dumps(self, style=False):
+        """Returns the path as a compact binary string, with its style
+        when style is True. See pathformat."""
+        import pathformat
+        return pathformat.dumps(self, style)
+
+    def dump(self, f, style=False):
+        """Writes the path to an open binary file, see dumps()."""
+        import pathformat
+        pathformat.dump(self, f, style)
+
+    def loads(cls, ctx, data):
+        """Makes a path from a string made with dumps()."""
+        import pathformat
+        return pathformat.loads(ctx, data, cls)
+    loads = classmethod(loads)
+
+    def load(cls, ctx, f):
+        """Reads the next path from an open binary file, see dump()."""
+        import pathformat
+        return pathformat.load(ctx, f, cls)
+    load = classmethod(load)
+
+    def _share(self, path):
+        """Makes this path a copy of the given path that shares its
+        storage, cached geometry and style. Whichever path changes
+        first makes its own copy, see _invalidate() and Grob._own_style().
+
+        When only a part of the storage belongs to the given path, such as
+        for a contour, that part is copied, without the cached geometry."""
+        start, end = path._range()
+        if end - start == len(path._cmds):
+            self._cmds = path._cmds
+            self._coords = path._coords
+            self._shared = path._shared = True
+            # A path that changes gets a new store, it never changes this one.
+            self._geometry = path._geometry
+            self._version = path._version
+        else:
+            self._cmds = path._cmds[start:end]
+            self._coords = path._coords[start*6:end*6]
+        self._share_style(path)
+
+    def _share_style(self, path):
+        for attr in self.stateAttributes:
+            setattr(self, attr, getattr(path, attr))
+        self._style = path._style
+        self._style_shared = path._style_shared = True
+
     ### Path methods ###
 
     def moveto(self, x, y):
-        self._elements.append(PathElement(MOVETO, ((x,y),)))
+        self._invalidate()
+        self._cmds.append(MOVETO)
+        self._coords.extend((x, y, x, y, x, y))
 
     def lineto(self, x, y):
-        self._elements.append(PathElement(LINETO, ((x,y),)))
+        self._invalidate()
+        self._cmds.append(LINETO)
+        self._coords.extend((x, y, x, y, x, y))
 
     def curveto(self, x1, y1, x2, y2, x3, y3):
-        self._elements.append(PathElement(CURVETO, ((x1,y1),(x2,y2),(x3,y3))))
+        self._invalidate()
+        self._cmds.append(CURVETO)
+        self._coords.extend((x3, y3, x1, y1, x2, y2))
 
     def closepath(self):
-        self._elements.append(PathElement(CLOSE, None))
+        self._invalidate()
+        self._cmds.append(CLOSE)
+        self._coords.extend((0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
 
     def setlinewidth(self, width):
         self.linewidth = width
 
     def _get_bounds(self):
-        try:
-            context = self._ctx.canvas.cairoContext
-            context.Save()
-            self._execute(context)
-            b = context.StrokeExtents()
-
-            # it seems this is necessary to clear the path after execution
-            # even though wrapped with a save/restore
-            # i assume that cairo is smart enough to do a no-op if alpha=0
-            context.Color = Cairo.Color(0,0,0,0)
-            context.Stroke()
-
-            context.Restore()
-            # print "bounds are: %f %f %f %f"%(b.X, b.Y, b.Width, b.Height)
-            return (b.X, b.Y) , (b.Width, b.Height)
-        except:
-            # print 'exception caught'
-            # Path is empty -- no bounds
-            return (0,0) , (0,0)
-
+        """Returns the bounds of the path geometry, without the stroke."""
+        import bezier
+        return self._cached('bounds', lambda: bezier.bounds(self))
     bounds = property(_get_bounds)
 
-    # def contains(self, x, y):
-    #     return self._nsBezierPath.containsPoint_((x,y))
+    def _get_strokebounds(self):
+        """Returns the bounds of the path including the stroke, if it has one.
+        Assumes round joins: sharp miter joins may reach further."""
+        (x, y), (w, h) = self.bounds
+        if self._strokecolor is None or len(self) == 0:
+            return (x, y), (w, h)
+        d = self._strokewidth / 2.0
+        return (x-d, y-d), (w+2*d, h+2*d)
+    strokebounds = property(_get_strokebounds)
+
+    def _paint_bounds(self):
+        """Returns the box the path paints in when it is drawn with its
+        transform, see _paint_box(). Paths that paint nothing return None:
+        Cairo keeps their elements for the next path that is painted."""
+        if self._fillcolor is None and self._strokecolor is None:
+            return None
+        key = ('paintbounds', tuple(self._transform), self._transformmode,
+               self._strokecolor is not None and self._strokewidth)
+        return self._cached(key, lambda: _paint_box(self, self.transform))
+
+    def contains(self, x, y, evenodd=False):
+        """Returns True if the point (x, y) is inside the path.
+        See bezier.contains()."""
+        import bezier
+        return bezier.contains(self, x, y, evenodd)
+
+    def contains_many(self, points, evenodd=False):
+        """Tests a sequence of (x, y) points against the path at once.
+        See bezier.contains_many()."""
+        import bezier
+        return bezier.contains_many(self, points, evenodd)
         
     ### Basic shapes ###
     
     def rect(self, x, y, width, height):
-        self._segment_cache = None
-        self._elements.append(PathElement(RECT, ((x,y),(width,height))))
+        self._invalidate()
+        self._cmds.append(RECT)
+        self._coords.extend((x, y, width, height, 0.0, 0.0))
         # self._nsBezierPath.appendBezierPathWithRect_( ((x, y), (width, height)) )
         
     def oval(self, x, y, width, height):
-        self._segment_cache = None
+        self._invalidate()
         hdiff = width / 2 * KAPPA
         vdiff = height / 2 * KAPPA
         self.moveto(x + width/2, y + height)
@@ -295,40 +511,107 @@ class BezierPath(Grob, TransformMixin, ColorMixin):
         self.curveto(x + width, y + height/2 + vdiff, x + width/2 + hdiff, y + height, x + width/2, y + height)
         
     def line(self, x1, y1, x2, y2):
-        self._segment_cache = None
+        self._invalidate()
         self.moveto(x1, y1)
         self.lineto(x2, y2)
 
     ### List methods ###
 
     def __getitem__(self, index):
-        el = self._elements[index]
-        return el.copy()
+        return _element(*self._segment(index))
 
     def __iter__(self):
-        for i in range(len(self)):
-            yield self[i]
+        for segment in self.iter_segments():
+            yield _element(*segment)
 
     def __len__(self):
-        return len(self._elements)
+        start, end = self._range()
+        return end - start
+
+    def _range(self):
+        """Returns the index of the first element of the storage that
+        belongs to the path, and the index after the last one."""
+        return 0, len(self._cmds)
+
+    def iter_segments(self):
+        """Iterates over the path without copying it into PathElements.
+
+        Yields a (cmd, x, y, ctrl1.x, ctrl1.y, ctrl2.x, ctrl2.y) tuple
+        for each element, with the values its PathElement would have.
+        Use this when reading a path; index or iterate the path itself
+        for elements you can change."""
+        start, end = self._range()
+        coords = self._coords
+        j = start * 6
+        for cmd in self._cmds[start:end]:
+            yield (cmd, coords[j], coords[j+1], coords[j+2],
+                   coords[j+3], coords[j+4], coords[j+5])
+            j += 6
+
+    def _segment(self, index):
+        """Returns the element at index as a tuple, see iter_segments()."""
+        start, end = self._range()
+        if index < 0:
+            index += end - start
+        if index < 0 or index >= end - start:
+            raise IndexError, "path index out of range"
+        index += start
+        i = index * 6
+        return (self._cmds[index],) + tuple(self._coords[i:i+6])
 
     def extend(self, pathElements):
-        self._segment_cache = None
+        # Collect the elements first and append them all at once.
+        cmds = array('B')
+        coords = array('d')
+        empty = len(self) == 0
         for el in pathElements:
             if isinstance(el, (list, tuple)):
                 x, y = el
-                if len(self) == 0:
-                    cmd = MOVETO
+                if empty and len(cmds) == 0:
+                    cmds.append(MOVETO)
                 else:
-                    cmd = LINETO
-                self.append(PathElement(cmd, ((x, y),)))
+                    cmds.append(LINETO)
+                coords.extend((x, y))
             elif isinstance(el, PathElement):
-                self.append(el)
+                cmds.append(el.cmd)
+                if el.cmd == MOVETO or el.cmd == LINETO:
+                    coords.extend((el.x, el.y))
+                elif el.cmd == CURVETO:
+                    coords.extend((el.ctrl1.x, el.ctrl1.y, el.ctrl2.x, el.ctrl2.y, el.x, el.y))
+                elif el.cmd == RECT:
+                    coords.extend((el.x, el.y, el.ctrl1.x, el.ctrl1.y))
             else:
                 raise NodeBoxError, "Don't know how to handle %s" % el
+        self._append_commands(cmds, coords)
+
+    def _append_commands(self, cmds, coords):
+        """Appends commands with their coordinates, see from_commands()."""
+        cmds = _as_array('B', cmds)
+        source = _as_array('d', coords)
+        out = array('d', [0.0]) * (6 * len(cmds))
+        i = j = 0
+        for run in _COMMAND_RUN.finditer(cmds.tostring()):
+            cmd = cmds[i]
+            if cmd not in _COMMAND_LAYOUT:
+                raise NodeBoxError, "Unknown path command %s" % cmd
+            count = len(run.group())
+            width, slots = _COMMAND_LAYOUT[cmd]
+            end = j + width * count
+            if end > len(source):
+                raise NodeBoxError, "There are fewer coordinates than the commands need"
+            for slot, offset in enumerate(slots):
+                if offset is not None:
+                    out[6*i+slot:6*(i+count):6] = source[j+offset:end:width]
+            i += count
+            j = end
+        if j != len(source):
+            raise NodeBoxError, "There are more coordinates than the commands need"
+        self._invalidate()
+        self._cmds.extend(cmds)
+        self._coords.extend(out)
 
     def append(self, el):
-        self._segment_cache = None
+        self._invalidate()
         if el.cmd == MOVETO:
             self.moveto(el.x, el.y)
         elif el.cmd == LINETO:
@@ -337,10 +620,16 @@ class BezierPath(Grob, TransformMixin, ColorMixin):
             self.curveto(el.ctrl1.x, el.ctrl1.y, el.ctrl2.x, el.ctrl2.y, el.x, el.y)
         elif el.cmd == CLOSE:
             self.closepath()
+        elif el.cmd == RECT:
+            self.rect(el.x, el.y, el.ctrl1.x, el.ctrl1.y)
             
     def _get_contours(self):
+        """Returns the contours of the path as views of its elements.
+        Where they start and end is cached until the path changes.
+        See bezier.contour_ranges()."""
         from nodebox.graphics import bezier
-        return bezier.contours(self)
+        ranges = self._cached('contours', lambda: bezier.contour_ranges(self))
+        return [Contour(self._ctx, self, start, end) for start, end in ranges]
     contours = property(_get_contours)
 
     ### Drawing methods ###
@@ -348,7 +637,6 @@ class BezierPath(Grob, TransformMixin, ColorMixin):
     def _get_transform(self):
         trans = self._transform.copy()
         if (self._transformmode == CENTER):
-            # XXX incorrect until bounds method is fixed
             (x, y), (w, h) = self.bounds
             deltax = x+w/2
             deltay = y+h/2
@@ -362,77 +650,196 @@ class BezierPath(Grob, TransformMixin, ColorMixin):
     transform = property(_get_transform)
 
     def _draw(self):
-        context = self._ctx.canvas.cairoContext
-
-        context.Save()
-
-        self.transform.concat()
-
-        self._execute(context)
-
-        if self._fillcolor and self._strokecolor:
-            fill_method = context.FillPreserve
-        else:
-            fill_method = context.Fill
-
-        if self._fillcolor:
-            self._fillcolor.set()
-            fill_method()
-
-        if self._strokecolor:
-            self._strokecolor.set()
-            context.LineWidth = self._strokewidth
-            context.Stroke()
-
-        context.Restore()
+        canvas = self._ctx.canvas
+        Batch(canvas, self, canvas._state.absolute(self.transform)).draw()
     
     def _execute(self, context):
-        for el in self._elements:
-            el._execute(context)
+        cmds = self._cmds
+        coords = self._coords
+        start, end = self._range()
+        for i in xrange(start, end):
+            cmd = cmds[i]
+            j = i * 6
+            if cmd == MOVETO:
+                context.MoveTo(coords[j], coords[j+1])
+            elif cmd == LINETO:
+                context.LineTo(coords[j], coords[j+1])
+            elif cmd == CURVETO:
+                context.CurveTo(coords[j+2], coords[j+3], coords[j+4], coords[j+5],
+                                coords[j], coords[j+1])
+            elif cmd == CLOSE:
+                context.ClosePath()
+            elif cmd == RECT:
+                context.Rectangle(coords[j], coords[j+1], coords[j+2], coords[j+3])
         
     ### Mathematics ###
     
-    def segmentlengths(self, relative=False, n=10):
+    def segmentlengths(self, relative=False, n=None, tolerance=LENGTH_TOLERANCE):
+        """Returns a list with the lengths of each segment in the path.
+        Curves are measured up to the given tolerance, or with n points if n is set.
+        The result is cached until the path changes."""
         import bezier
-        if relative: # Use the opportunity to store the segment cache.
-            if self._segment_cache is None:
-                self._segment_cache = bezier.segment_lengths(self, relative=True, n=n)
-            return self._segment_cache
-        else:
-            return bezier.segment_lengths(self, relative=False, n=n)
+        if n is not None:
+            tolerance = None
+        return self._cached(('segmentlengths', relative, n, tolerance),
+            lambda: bezier.segment_lengths(self, relative=relative, n=n, tolerance=tolerance))
+
+    def _lookup(self):
+        """Returns the cached lookup table used to locate t on the path.
+        See bezier.lookup_table()."""
+        import bezier
+        return self._cached('lookup',
+            lambda: bezier.lookup_table(self, self.segmentlengths(relative=True)))
+
+    def _cached(self, key, make):
+        """Returns the cached result for key, or computes it with make().
+        Results are kept for the current version of the path,
+        within the memory budget of geometrycache.cache."""
+        store = self._geometry
+        if store is None or store.version != self._version:
+            store = self._geometry = geometrycache.GeometryStore(self._version)
+        return geometrycache.cache.get(store, key, make)
+
+    def _invalidate(self):
+        """Counts a change to the path, which makes the cached geometry
+        stale. Called whenever the path changes, before it changes, so
+        a path that shares its storage with a copy can make its own copy first."""
+        if self._shared:
+            self._cmds = array('B', self._cmds)
+            self._coords = array('d', self._coords)
+            self._shared = False
+        self._version += 1
+        self._geometry = None
+
+    def _replace(self, cmds, coords):
+        """Makes the path use the given storage,
+        which should not be used by anything else."""
+        self._cmds, self._coords = cmds, coords
+        self._shared = False
+        self._invalidate()
+
+    def flatten(self, tolerance=FLATNESS):
+        """Returns the path as a list of polylines, one for each contour.
+        The result is cached per tolerance until the path changes.
+        Only hit testing uses it; length, points and bounds are computed
+        on the curves, more precisely than the polylines allow.
+        See flatten.flatten()."""
+        import flatten
+        return self._cached(('flatten', tolerance), lambda: flatten.flatten(self, tolerance))
+
+    def _edgeindex(self):
+        """Returns the cached edge index used for point-in-path tests.
+        See flatten.EdgeIndex."""
+        import flatten
+        return self._cached('edgeindex', lambda: flatten.EdgeIndex(self.flatten()))
+
+    def simplify(self, tolerance=FLATNESS):
+        """Replaces the path by one with fewer elements that stays within tolerance of it.
+        See bezier.simplify()."""
+        import bezier
+        path = bezier.simplify(self, tolerance)
+        self._replace(path._cmds, path._coords)
 
-    def _get_length(self, segmented=False, n=10):
+    def _simplified(self, tolerance):
+        """Returns the cached simplified copy of the path that is drawn
+        when Canvas.simplify is set."""
         import bezier
-        return bezier.length(self, segmented=segmented, n=n)
+        def make():
+            path = bezier.simplify(self, tolerance)
+            if len(path) == len(self):
+                # Nothing to gain: draw the path itself.
+                return None
+            return path
+        path = self._cached(('simplify', tolerance), make)
+        if path is None:
+            return self
+        return path
+
+    def _get_length(self, segmented=False, n=None, tolerance=LENGTH_TOLERANCE):
+        if segmented:
+            return self.segmentlengths(relative=True, n=n, tolerance=tolerance)
+        return sum(self.segmentlengths(n=n, tolerance=tolerance), 0.0)
     length = property(_get_length)
         
     def point(self, t):
         import bezier
         return bezier.point(self, t)
         
-    def points(self, amount=100):
+    def points(self, amount=100, tuples=False):
         import bezier
-        if len(self) == 0:
-            raise NodeBoxError, "The given path is empty"
-
-        # The delta value is divided by amount - 1, because we also want the last point (t=1.0)
-        # If I wouldn't use amount - 1, I fall one point short of the end.
-        # E.g. if amount = 4, I want point at t 0.0, 0.33, 0.66 and 1.0,
-        # if amount = 2, I want point at t 0.0 and t 1.0
-        try:
-            delta = 1.0/(amount-1)
-        except ZeroDivisionError:
-            delta = 1.0
+        return bezier.points(self, amount, tuples)
 
-        for i in xrange(amount):
-            yield self.point(delta*i)
+    def sample(self, amount=100, out=None):
+        import bezier
+        return bezier.sample(self, amount, out)
             
     def addpoint(self, t):
         import bezier
-        self._elements = bezier.insert_point(self, t)._elements
-        self._segment_cache = None
+        path = bezier.insert_point(self, t)
+        self._replace(path._cmds, path._coords)
+
+    def addpoints(self, ts):
+        """Adds a point at each of the t values, splitting all segments in one pass.
+        See bezier.insert_points()."""
+        import bezier
+        path = bezier.insert_points(self, ts)
+        self._replace(path._cmds, path._coords)
+
+class Contour(BezierPath):
+    """A contour of a BezierPath, see BezierPath.contours.
+
+    A contour is a view of a range of the elements of a path, with its
+    style. It reads the storage of the path instead of copying it, and
+    only makes its own copy when it is changed. Otherwise it works like
+    any other path.
+    """
+
+    def __init__(self, ctx, path=None, start=None, end=None):
+        BezierPath.__init__(self, ctx, path)
+        if start is not None:
+            offset = path._range()[0]
+            self._view = (offset + start, offset + end)
+            # The cached geometry of the path doesn't apply to a part of it.
+            self._geometry = None
+
+    # None when the contour has its own storage.
+    _view = None
+
+    def _share(self, path):
+        view = getattr(path, '_view', None)
+        if view is None:
+            BezierPath._share(self, path)
+            return
+        # A copy of a contour reads the same part of the same storage.
+        self._cmds = path._cmds
+        self._coords = path._coords
+        self._view = view
+        self._geometry = path._geometry
+        self._version = path._version
+        self._share_style(path)
+
+    def _range(self):
+        if self._view is None:
+            return BezierPath._range(self)
+        return self._view
+
+    def _invalidate(self):
+        if self._view is not None:
+            start, end = self._view
+            self._cmds = self._cmds[start:end]
+            self._coords = self._coords[start*6:end*6]
+            self._shared = False
+            self._view = None
+        BezierPath._invalidate(self)
+
+    def _replace(self, cmds, coords):
+        self._view = None
+        BezierPath._replace(self, cmds, coords)
 
 class PathElement(object):
+
+    __slots__ = ('cmd', 'x', 'y', 'ctrl1', 'ctrl2')
+
     def __init__(self, cmd=None, pts=None):
         self.cmd = cmd
         if cmd == MOVETO:
@@ -485,6 +892,9 @@ class PathElement(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self.cmd, self.x, self.y, self.ctrl1.x, self.ctrl1.y, self.ctrl2.x, self.ctrl2.y))
+
     def copy(self):
         el = PathElement()
         # XXX find a nicer way to copy myself
@@ -512,6 +922,52 @@ class PathElement(object):
         elif self.cmd == RECT:
             context.Rectangle(x, y, x1, y1)
 
+def _as_array(typecode, values):
+    """Returns the values as an array of the given type,
+    without copying them if they already are one."""
+    if isinstance(values, array) and values.typecode == typecode:
+        return values
+    return array(typecode, values)
+
+def _transform_box(x, y, w, h, matrix, d=0.0):
+    """Returns the box (left, top, right, bottom) around the rectangle
+    transformed with the matrix, a tuple of six numbers, grown by d."""
+    xx, yx, xy, yy, x0, y0 = matrix
+    # The corner the box starts at, and how far the other corners reach.
+    left = x0 + xx*x + xy*y - d
+    top = y0 + yx*x + yy*y - d
+    dx1, dx2, dy1, dy2 = xx*w, xy*h, yx*w, yy*h
+    return (left + min(dx1, 0) + min(dx2, 0), top + min(dy1, 0) + min(dy2, 0),
+            left + max(dx1, 0) + max(dx2, 0) + 2*d, top + max(dy1, 0) + max(dy2, 0) + 2*d)
+
+def _paint_box(path, transform):
+    """Returns the box the path paints in when it is drawn with the transform,
+    with a pixel to spare for antialiasing. The stroke is assumed to reach
+    as far as Cairo's default miter limit lets joins reach."""
+    (x, y), (w, h) = path.bounds
+    matrix = tuple(transform)
+    d = 1.0
+    if path._strokecolor is not None:
+        xx, yx, xy, yy = matrix[:4]
+        d += MITER_REACH * path._strokewidth * sqrt(xx*xx + yx*yx + xy*xy + yy*yy)
+    return _transform_box(x, y, w, h, matrix, d)
+
+def _overlaps(box, other):
+    left, top, right, bottom = box
+    l, t, r, b = other
+    return left < r and l < right and top < b and t < bottom
+
+def _element(cmd, x, y, x1, y1, x2, y2):
+    """Makes a PathElement from a command and the six numbers BezierPath stores for it."""
+    # Skip __init__, which would make two Points only to replace them.
+    el = PathElement.__new__(PathElement)
+    el.cmd = cmd
+    el.x = x
+    el.y = y
+    el.ctrl1 = Point(x1, y1)
+    el.ctrl2 = Point(x2, y2)
+    return el
+
 class ClippingPath(Grob):
 
     def __init__(self, ctx, path):
@@ -521,27 +977,39 @@ class ClippingPath(Grob):
         
     def append(self, grob):
         self._grobs.append(grob)
+
+    def _paint_bounds(self):
+        """Nothing is painted outside the clip, which is drawn without a transform."""
+        (x, y), (w, h) = self.path.bounds
+        return (x - 1.0, y - 1.0, x + w + 1.0, y + h + 1.0)
         
     def _draw(self):
-        context = self._ctx.canvas.cairoContext
-
-        context.Save()
+        canvas = self._ctx.canvas
+        context = canvas.cairoContext
+        state = canvas._state
+
+        # The clip is drawn without a transform, and only
+        # applies until the state is restored.
+        state.set_transform(None)
+        state.save()
         # cp = self.path.transform.transformBezierPath(self.path)
         # cp._nsBezierPath.addClip()
 
         self.path._execute(context)
         context.Clip()
+        state.clip(self._paint_bounds())
 
-        for grob in self._grobs:
-            grob._draw()
+        canvas._draw_grobs(self._grobs)
 
-        context.Restore()
+        state.restore()
     
     def copy(self):
         pass
 
 class Color(object):
 
+    __slots__ = ('_ctx', '_rgb', '_cmyk')
+
     def __init__(self, ctx, *args):
         self._ctx = ctx
         params = len(args)
@@ -606,6 +1074,20 @@ class Color(object):
         return "%s(%.3f, %.3f, %.3f, %.3f)" % (self.__class__.__name__, self.red,
                 self.green, self.blue, self.alpha)
 
+    def __eq__(self, other):
+        if not isinstance(other, Color): return False
+        return self._components() == other._components()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._components())
+
+    def _components(self):
+        clr = self.cairoColor
+        return (clr.R, clr.G, clr.B, clr.A)
+
     def set(self):
         # print "setting color " + str(self)
         self._ctx.canvas.cairoContext.Color = self.cairoColor
@@ -837,21 +1319,21 @@ class Text(Grob, TransformMixin, ColorMixin):
         if self._fillcolor is None: return
         x, y = self.x, self.y
 
-        print "Writing text %s font face %s size %d"%(self.text, self._fontname, self._fontsize)
-        context = self._ctx.canvas.cairoContext
-
-        context.Save()
+        canvas = self._ctx.canvas
+        context = canvas.cairoContext
+        state = canvas._state
 
-        self._fillcolor.set()
-        self.transform.concat()
+        state.set_color(self._fillcolor)
+        # Read the transform without taking it over from a shared style:
+        # tiles draw the same text on several threads at once.
+        state.set_transform(self._transform)
+        state.avoided += 2
 
         context.SelectFontFace(self._fontname, Cairo.FontSlant.Normal, Cairo.FontWeight.Normal)
         context.SetFontSize(self._fontsize)
         context.MoveTo(self.x, self.y)
         context.ShowText(self.text)
 
-        context.Restore()
-
         # if self._fillcolor is None: return
         # layoutManager, textContainer, textStorage = self._getLayoutManagerTextContainerTextStorage(self._fillcolor.nsColor)
         # x,y = self.x, self.y
@@ -925,6 +1407,8 @@ class Text(Grob, TransformMixin, ColorMixin):
 
 class Transform(object):
 
+    __slots__ = ('_ctx', '_matrix')
+
     def __init__(self, ctx, transform=None):
         self._ctx = ctx
         if transform is None:
@@ -955,11 +1439,19 @@ class Transform(object):
         return "<%s [%.3f %.3f %.3f %.3f %.3f %.3f]>" % ((self.__class__.__name__,)
                  + tuple(self))
 
+    def __eq__(self, other):
+        if not isinstance(other, Transform): return False
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
     def __iter__(self):
-        values = (self._matrix.Xx, self._matrix.Yx, self._matrix.Xy,
-                  self._matrix.Yy, self._matrix.X0, self._matrix.Y0)
-        for value in values:
-            yield value
+        m = self._matrix
+        return iter((m.Xx, m.Yx, m.Xy, m.Yy, m.X0, m.Y0))
 
     def _get_matrix(self):
         return self._matrix.Clone()
@@ -1001,18 +1493,291 @@ class Transform(object):
         self._matrix = Cairo.Matrix.Multiply(other, self._matrix)
 
     def transformPoint(self, point):
-        (rx, ry) = (point.x, point.y)
-        self._matrix.TransformPoint(rx, ry)
-        return (rx, ry)
+        xx, yx, xy, yy, x0, y0 = tuple(self)
+        return (xx*point.x + xy*point.y + x0, yx*point.x + yy*point.y + y0)
+
+    def transform_points(self, coords):
+        """Returns an array with the transformed points of
+        a flat sequence of coordinates: x, y, x, y, ..."""
+        coords = _as_array('d', coords)
+        if len(coords) % 2 != 0:
+            raise NodeBoxError, "The coordinates should come in pairs"
+        xx, yx, xy, yy, x0, y0 = tuple(self)
+        xs, ys = coords[0::2], coords[1::2]
+        out = array('d', [0.0]) * len(coords)
+        out[0::2] = array('d', [xx*x + xy*y + x0 for x, y in izip(xs, ys)])
+        out[1::2] = array('d', [yx*x + yy*y + y0 for x, y in izip(xs, ys)])
+        return out
+
+    def transform_path(self, path):
+        """Returns a copy of the path with the transform applied to its points.
+
+        The points are transformed in Python, without a Cairo context.
+        Rectangles become four lines, since they may not stay rectangles."""
+        if not isinstance(path, BezierPath):
+            raise NodeBoxError, "Can only transform BezierPaths"
+        start, end = path._range()
+        cmds = path._cmds[start:end]
+        if RECT in cmds:
+            cmds = array('B')
+            coords = array('d')
+            for cmd, x, y, x1, y1, x2, y2 in path.iter_segments():
+                if cmd == RECT:
+                    cmds.extend((MOVETO, LINETO, LINETO, LINETO, CLOSE))
+                    for px, py in ((x, y), (x+x1, y), (x+x1, y+y1), (x, y+y1)):
+                        coords.extend((px, py, px, py, px, py))
+                    coords.extend((0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+                else:
+                    cmds.append(cmd)
+                    coords.extend((x, y, x1, y1, x2, y2))
+        else:
+            coords = path._coords[start*6:end*6]
+        # Every element stores three points, see BezierPath.
+        coords = self.transform_points(coords)
+        # CLOSE has no points: keep its zeros.
+        commands = cmds.tostring()
+        i = commands.find(chr(CLOSE))
+        while i != -1:
+            coords[i*6:i*6+6] = array('d', (0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+            i = commands.find(chr(CLOSE), i+1)
+        path = path.copy()
+        path._replace(cmds, coords)
+        return path
+    transformBezierPath = transform_path
+
+
+class Batch(object):
+
+    """Consecutive paths with the same style, drawn with one fill and one stroke.
+
+    Paths are only added when what they paint can't touch what the
+    paths already in the batch paint, so drawing them together gives
+    the same pixels as drawing them one by one, whatever their alpha.
+    Their transforms may differ, since Cairo transforms a path as it is
+    made: only paths with a stroke need the same scale and rotation,
+    which the stroke is drawn with.
+    """
+
+    # The most paths in a batch, which bounds the overlap tests.
+    MAX_SIZE = 64
+
+    def __init__(self, canvas, path, matrix, key=None):
+        self.canvas = canvas
+        self.paths = [path]
+        self.matrices = [matrix]
+        self.style = key
+        self._boxes = []
+
+    def key(cls, path, matrix):
+        """Returns what paths need to have in common to be batched,
+        or None if the path can't be batched.
+
+        A path that doesn't start with a MOVETO or a RECT continues
+        from where the path before it ends, so it is drawn on its own.
+
+        >>> from nodebox.graphics import Context
+        >>> ctx = Context()
+        >>> path = ctx.BezierPath(fill=(0, 0, 0))
+        >>> path.lineto(10, 10)
+        >>> path.lineto(20, 0)
+        >>> Batch.key(path, Transform(None)) is None
+        True
+        >>> path = ctx.BezierPath(fill=(0, 0, 0))
+        >>> path.rect(0, 0, 10, 10)
+        >>> Batch.key(path, Transform(None)) is None
+        False
+        """
+        fill, stroke = path._fillcolor, path._strokecolor
+        if fill is None and stroke is None or len(path) == 0:
+            return None
+        if path._cmds[path._range()[0]] not in (MOVETO, RECT):
+            return None
+        if fill is not None:
+            fill = fill._components()
+        if stroke is None:
+            return (fill, None, None, None)
+        return (fill, stroke._components(), path._strokewidth, tuple(matrix)[:4])
+    key = classmethod(key)
+
+    def add(self, path, matrix, key):
+        """Adds the path to the batch if it can be drawn with the other
+        paths. Returns True if it was added."""
+        if key != self.style or len(self.paths) >= self.MAX_SIZE:
+            return False
+        boxes = self._boxes
+        if not boxes:
+            boxes.append(_paint_box(self.paths[0], self.matrices[0]))
+        box = _paint_box(path, matrix)
+        for other in boxes:
+            if _overlaps(box, other):
+                return False
+        boxes.append(box)
+        self.paths.append(path)
+        self.matrices.append(matrix)
+        return True
 
-#    def transformBezierPath(self, path):
-#        if isinstance(path, BezierPath):
-#            path = BezierPath(path._ctx, path)
-#        else:
-#            raise NodeBoxError, "Can only transform BezierPaths"
-#        path._nsBezierPath = self._nsAffineTransform.transformBezierPath_(path._nsBezierPath)
-#        return path
+    def draw(self):
+        canvas = self.canvas
+        context = canvas.cairoContext
+        state = canvas._state
+        tolerance = canvas.simplify
+
+        for path, matrix in izip(self.paths, self.matrices):
+            # Paths set every part of the state they draw with,
+            # so they don't need to save and restore it.
+            state.set_matrix(matrix)
+            state.avoided += 2
+            if tolerance:
+                path._simplified(tolerance)._execute(context)
+            else:
+                path._execute(context)
+        if len(self.paths) > 1:
+            state.batches += 1
+            state.batched += len(self.paths)
 
+        path = self.paths[0]
+        if path._fillcolor and path._strokecolor:
+            fill_method = context.FillPreserve
+        else:
+            fill_method = context.Fill
+
+        if path._fillcolor:
+            state.set_color(path._fillcolor)
+            fill_method()
+
+        if path._strokecolor:
+            state.set_color(path._strokecolor)
+            state.set_linewidth(path._strokewidth)
+            context.Stroke()
+
+class RenderState(object):
+
+    """Tracks the color, line width and matrix of a Cairo context while
+    the canvas is drawn, so they are only changed when they differ.
+
+    Grob transforms are set as absolute matrices on top of the matrix the
+    context had when drawing started, instead of being concatenated
+    between a save and a restore. Counts the state changes that were
+    issued and those that were avoided.
+
+    Also keeps the viewport: the box, in the space grobs are drawn in
+    without their transform, outside of which nothing shows. The device
+    space viewport (left, top, right, bottom) is given, or None to draw
+    everything.
+    """
+
+    def __init__(self, context, viewport=None):
+        self.context = context
+        self._base = Transform(None, context.Matrix)
+        self._matrix = tuple(self._base)
+        self.viewport = None
+        if viewport is not None:
+            self.viewport = self._unproject(viewport)
+        self._color = None
+        self._linewidth = None
+        self._stack = []
+        self.changes = 0
+        self.avoided = 0
+        # Batches of more than one path, and the paths in them.
+        self.batches = 0
+        self.batched = 0
+        # Grobs that were not drawn because they are outside the viewport.
+        self.culled = 0
+
+    def _unproject(self, box):
+        xx, yx, xy, yy, x0, y0 = self._matrix
+        det = float(xx*yy - xy*yx)
+        if det == 0:
+            # Nothing shows at all, but there is no box to say so.
+            return None
+        ixx, iyx, ixy, iyy = yy/det, -yx/det, -xy/det, xx/det
+        inverse = (ixx, iyx, ixy, iyy, -ixx*x0 - ixy*y0, -iyx*x0 - iyy*y0)
+        left, top, right, bottom = box
+        return _transform_box(left, top, right - left, bottom - top, inverse)
+
+    def visible(self, grob):
+        """Returns False if nothing the grob paints can show."""
+        if self.viewport is None:
+            return True
+        box = grob._paint_bounds()
+        return box is None or _overlaps(box, self.viewport)
+
+    def clip(self, box):
+        """Narrows the viewport to the box, until the state is restored."""
+        if self.viewport is not None:
+            left, top, right, bottom = self.viewport
+            l, t, r, b = box
+            self.viewport = (max(left, l), max(top, t), min(right, r), min(bottom, b))
+
+    def set_color(self, color):
+        components = color._components()
+        if components == self._color:
+            self.avoided += 1
+            return
+        self.context.Color = color.cairoColor
+        self._color = components
+        self.changes += 1
+
+    def set_linewidth(self, width):
+        if width == self._linewidth:
+            self.avoided += 1
+            return
+        self.context.LineWidth = width
+        self._linewidth = width
+        self.changes += 1
+
+    def absolute(self, transform):
+        """Returns a Transform with the matrix to draw with the given transform,
+        or without one if it is None. The transform itself is left as it is,
+        since it can be the grob's own, which is drawn again on every draw.
+
+        >>> from nodebox.graphics import Context
+        >>> ctx = Context()
+        >>> ctx.canvas.cairoContext.Matrix = Cairo.Matrix(2, 0, 0, 2, 5, 5)
+        >>> state = RenderState(ctx.canvas.cairoContext)
+        >>> transform = Transform(None)
+        >>> transform.translate(10, 20)
+        >>> state.absolute(transform)
+        <Transform [2.000 0.000 0.000 2.000 25.000 45.000]>
+        >>> transform
+        <Transform [1.000 0.000 0.000 1.000 10.000 20.000]>
+
+        Drawing again draws the grobs with the same matrix:
+        >>> ctx.text("hi", 10, 20) and None
+        >>> ctx.canvas.draw()
+        >>> ctx.canvas.draw()
+        >>> ctx.canvas[0].transform
+        <Transform [1.000 0.000 0.000 1.000 0.000 0.000]>
+        """
+        if transform is None:
+            return self._base
+        transform = transform.copy()
+        transform.append(self._base)
+        return transform
+
+    def set_transform(self, transform):
+        """Draws with the given transform, or without one if it is None."""
+        self.set_matrix(self.absolute(transform))
+
+    def set_matrix(self, transform):
+        """Draws with the matrix of the transform, see absolute()."""
+        matrix = tuple(transform)
+        if matrix == self._matrix:
+            self.avoided += 1
+            return
+        self.context.Matrix = transform._matrix
+        self._matrix = matrix
+        self.changes += 1
+
+    def save(self):
+        self.context.Save()
+        self._stack.append((self._color, self._linewidth, self._matrix, self.viewport))
+        self.changes += 1
+
+    def restore(self):
+        self.context.Restore()
+        self._color, self._linewidth, self._matrix, self.viewport = self._stack.pop()
+        self.changes += 1
 
 class Canvas(Grob):
 
@@ -1021,6 +1786,20 @@ class Canvas(Grob):
         self.height = height
         self.speed = None
         self.mousedown = False
+        # The tolerance paths are simplified with before they are drawn, if set.
+        self.simplify = None
+        # Whether runs of paths with the same style are drawn
+        # together, see Batch.
+        self.batch = False
+        # When set, draw() renders tiles of this many pixels square
+        # on a pool of threads, as many as workers, see tiles.py.
+        self.tilesize = None
+        self.workers = None
+        # The context and RenderState each thread draws with.
+        self._local = threading.local()
+        # How many state changes the last draw issued and avoided,
+        # how many paths it batched and how many grobs it culled.
+        self.stats = {}
         self.clear()
 
         self._resize()
@@ -1044,9 +1823,16 @@ class Canvas(Grob):
     cairoImage = property(_getCairoImage)
 
     def _getCairoContext(self):
-        return self._context
+        context = getattr(self._local, 'context', None)
+        if context is None:
+            return self._context
+        return context
     cairoContext = property(_getCairoContext)
 
+    def _get_state(self):
+        return getattr(self._local, 'state', None)
+    _state = property(_get_state)
+
     def clear(self):
         self._grobs = self._container = []
         self._grobstack = [self._grobs]
@@ -1086,12 +1872,71 @@ class Canvas(Grob):
             raise NodeBoxError, "pop: too many canvas pops!"
 
     def draw(self):
+        if self.tilesize:
+            import tiles
+            tiles.draw(self, self.tilesize, self.workers)
+            return
+        state = self._render(self._context, self._grobs, (0, 0, self.width, self.height))
+        self.stats = self._stats([state])
+
+    def _render(self, context, grobs, viewport):
+        """Draws the background and the grobs with the context, which the
+        current thread draws with until it is done. Returns the RenderState."""
+        local = self._local
+        local.context = context
+        context.Save()
+        local.state = state = RenderState(context, viewport)
         if self.background is not None:
-            self.background.set()
-            self.cairoContext.Rectangle(0, 0, self.width, self.height)
-            self.cairoContext.Fill()
-        for grob in self._grobs:
+            state.set_color(self.background)
+            context.Rectangle(0, 0, self.width, self.height)
+            context.Fill()
+        self._draw_grobs(grobs)
+        context.Restore()
+        local.context = local.state = None
+        return state
+
+    def _stats(self, states):
+        stats = {'state_changes': 0, 'state_changes_avoided': 0,
+                 'batches': 0, 'batched_paths': 0, 'culled': 0}
+        for state in states:
+            # Count the save and restore around the drawing.
+            stats['state_changes'] += state.changes + 2
+            stats['state_changes_avoided'] += state.avoided
+            stats['batches'] += state.batches
+            stats['batched_paths'] += state.batched
+            stats['culled'] += state.culled
+        return stats
+
+    def _draw_grobs(self, grobs):
+        state = self._state
+        if not self.batch:
+            for grob in grobs:
+                if state.visible(grob):
+                    grob._draw()
+                else:
+                    state.culled += 1
+            return
+        batch = None
+        for grob in grobs:
+            if not state.visible(grob):
+                state.culled += 1
+                continue
+            if isinstance(grob, BezierPath):
+                matrix = state.absolute(grob.transform)
+                key = Batch.key(grob, matrix)
+                if key is not None:
+                    if batch is not None:
+                        if batch.add(grob, matrix, key):
+                            continue
+                        batch.draw()
+                    batch = Batch(self, grob, matrix, key)
+                    continue
+            if batch is not None:
+                batch.draw()
+                batch = None
             grob._draw()
+        if batch is not None:
+            batch.draw()
             
     def _getImageData(self, format):
         # if format == 'pdf':
@@ -1126,3 +1971,10 @@ class Canvas(Grob):
         self.draw()
         self.cairoImage.WriteToPng(fname)
 
+def _test():
+    import doctest, caironet
+    return doctest.testmod(caironet)
+
+if __name__=='__main__':
+    _test()
+
@@ -0,0 +1,214 @@
+# Flatten - converts bezier paths into polylines.
+#
+# Point-in-path and hit testing work on a polyline approximation of
+# the path. This module builds that approximation once, at a given
+# tolerance, and BezierPath.flatten() caches it until the path changes.
+#
+# Length, sampling and culling don't use it. They need more than the
+# polyline gives: lengths are measured to LENGTH_TOLERANCE, finer than
+# FLATNESS; points on the path lie exactly on the curves and carry their
+# control handles; and the bounds used for culling must enclose the
+# curves, where the polyline can lie inside them by up to the tolerance.
+# They cache their own results, see BezierPath.segmentlengths() and
+# BezierPath._paint_bounds().
+
+from array import array
+from math import ceil, sqrt
+
+from nodebox.graphics import NodeBoxError, MOVETO, LINETO, CURVETO, CLOSE, RECT
+from nodebox.graphics.caironet import FLATNESS
+
+try:
+    from cPathmatics import curvepoints
+except:
+    from pathmatics import curvepoints
+
+def curvesteps(x0, y0, x1, y1, x2, y2, x3, y3, tolerance=FLATNESS):
+    """Returns the number of lines needed to draw the spline
+    with an error of at most tolerance.
+
+    The distance between a spline and n lines through
+    evenly spaced points on it is at most 1/8 of the largest
+    second derivative divided by n squared. For a cubic spline
+    that derivative is at most 6 times the largest distance
+    between the control points and their neighbours' midpoints.
+
+    >>> curvesteps(0, 0, 10, 0, 20, 0, 30, 0)
+    1
+    >>> curvesteps(0, 0, 0, 100, 100, 100, 100, 0)
+    33
+    """
+
+    ddx = max(abs(x0 - 2*x1 + x2), abs(x1 - 2*x2 + x3))
+    ddy = max(abs(y0 - 2*y1 + y2), abs(y1 - 2*y2 + y3))
+    dd = sqrt(ddx*ddx + ddy*ddy)
+    return max(1, int(ceil(sqrt(0.75 * dd / tolerance))))
+
+def flatten(path, tolerance=FLATNESS):
+    """Returns the path as a list of polylines, one for each contour.
+
+    Each polyline is a tuple (coords, closed), where coords is
+    a flat array of interleaved coordinates: [x, y, x, y, ...],
+    and closed is True when the contour is closed.
+    Curves are replaced by lines that are never more
+    than tolerance away from the curve.
+
+    Use BezierPath.flatten() to get a cached result.
+
+    >>> from nodebox.graphics import BezierPath
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.lineto(100, 0)
+    >>> path.lineto(100, 100)
+    >>> path.closepath()
+    >>> flatten(path)
+    [(array('d', [0.0, 0.0, 100.0, 0.0, 100.0, 100.0]), True)]
+    >>> path.rect(10, 10, 20, 20)
+    >>> len(flatten(path))
+    2
+    """
+
+    if tolerance <= 0:
+        raise NodeBoxError, "The tolerance should be larger than zero"
+
+    polylines = []
+    coords = None
+    closed = False
+    x0 = y0 = start_x = start_y = 0.0
+
+    for cmd, x3, y3, x1, y1, x2, y2 in path.iter_segments():
+        if cmd == MOVETO or cmd == RECT:
+            if coords is not None and len(coords) > 2:
+                polylines.append((coords, closed))
+            coords = None
+            x0, y0 = start_x, start_y = x3, y3
+            if cmd == RECT:
+                x, y, w, h = x3, y3, x1, y1
+                polylines.append((array('d', (x, y, x+w, y, x+w, y+h, x, y+h)), True))
+            continue
+        elif cmd == CLOSE:
+            if coords is not None:
+                closed = True
+                polylines.append((coords, closed))
+                coords = None
+            x0, y0 = start_x, start_y
+            continue
+
+        if coords is None:
+            # A contour starts at the current point, which is where
+            # the last MOVETO went, or where the last contour closed.
+            coords = array('d', (x0, y0))
+            closed = False
+            start_x, start_y = x0, y0
+
+        if cmd == LINETO:
+            coords.append(x3)
+            coords.append(y3)
+        elif cmd == CURVETO:
+            n = curvesteps(x0, y0, x1, y1, x2, y2, x3, y3, tolerance)
+            ts = [1.0 * i / n for i in xrange(1, n)]
+            coords.extend(curvepoints(ts, x0, y0, x1, y1, x2, y2, x3, y3))
+            # Use the exact end point, so contours meet where they should.
+            coords.append(x3)
+            coords.append(y3)
+        x0, y0 = x3, y3
+
+    if coords is not None and len(coords) > 2:
+        polylines.append((coords, closed))
+    return polylines
+
+class EdgeIndex(object):
+
+    """An index over the edges of polylines, to quickly test points against them.
+
+    The edges are sorted into horizontal bands, so a point is
+    only tested against the edges in its band, not against all of them.
+    As with filling, every polyline is closed, whether it is
+    marked as closed or not.
+
+    >>> index = EdgeIndex([(array('d', [0, 0, 100, 0, 100, 100, 0, 100]), True),
+    ...                    (array('d', [25, 25, 25, 75, 75, 75, 75, 25]), True)])
+    >>> index.winding(10, 10), index.winding(50, 50), index.winding(150, 50)
+    (1, 0, 0)
+    >>> index = EdgeIndex([(array('d', [0, 0, 100, 0, 100, 100, 0, 100]), True),
+    ...                    (array('d', [25, 25, 75, 25, 75, 75, 25, 75]), True)])
+    >>> index.contains(50, 50), index.contains(50, 50, evenodd=True)
+    (True, False)
+    """
+
+    # The maximum number of bands.
+    MAX_BANDS = 4096
+
+    def __init__(self, polylines):
+        edges = array('d')
+        for coords, closed in polylines:
+            n = len(coords)
+            if n < 4: continue
+            px, py = coords[n-2], coords[n-1]
+            for j in xrange(0, n, 2):
+                x, y = coords[j], coords[j+1]
+                # Horizontal edges never cross the ray used to count the winding.
+                if y != py:
+                    edges.extend((px, py, x, y))
+                px, py = x, y
+        self._edges = edges
+
+        count = len(edges) // 4
+        self._bands = []
+        if count == 0:
+            return
+
+        ys = edges[1::2]
+        self._top = min(ys)
+        self._bottom = max(ys)
+        xs = edges[0::2]
+        self._left = min(xs)
+        self._right = max(xs)
+        amount = max(1, min(count // 2, self.MAX_BANDS))
+        self._height = (self._bottom - self._top) / amount
+        self._bands = bands = [[] for i in xrange(amount)]
+        for k in xrange(0, len(edges), 4):
+            y0, y1 = edges[k+1], edges[k+3]
+            if y0 > y1: y0, y1 = y1, y0
+            first = self._band(y0)
+            last = self._band(y1)
+            for b in xrange(first, last+1):
+                bands[b].append(k)
+
+    def _band(self, y):
+        return min(int((y - self._top) / self._height), len(self._bands)-1)
+
+    def winding(self, x, y):
+        """Returns the winding number of the point:
+        how many times the polylines go around it counter-clockwise,
+        minus how many times they go around it clockwise."""
+        if not self._bands or y < self._top or y >= self._bottom \
+           or x < self._left or x > self._right:
+            return 0
+        edges = self._edges
+        w = 0
+        for k in self._bands[self._band(y)]:
+            x0, y0, x1, y1 = edges[k], edges[k+1], edges[k+2], edges[k+3]
+            if y0 <= y:
+                if y1 > y and (x1-x0) * (y-y0) - (x-x0) * (y1-y0) > 0:
+                    w += 1
+            elif y1 <= y and (x1-x0) * (y-y0) - (x-x0) * (y1-y0) < 0:
+                w -= 1
+        return w
+
+    def contains(self, x, y, evenodd=False):
+        """Returns True if the point is inside the polylines.
+
+        Uses the non-zero winding rule, like Cairo does when filling,
+        or the even-odd rule when evenodd is True."""
+        w = self.winding(x, y)
+        if evenodd:
+            return w % 2 != 0
+        return w != 0
+
+def _test():
+    import doctest, flatten
+    return doctest.testmod(flatten)
+
+if __name__=='__main__':
+    _test()
@@ -0,0 +1,190 @@
+# Geometrycache - keeps the geometry computed from paths within a memory budget.
+#
+# Paths cache what they compute from their elements: segment lengths,
+# lookup tables, bounds, polylines, contours and so on. A path keeps
+# these results in a GeometryStore made for its current version, its
+# mutation counter. A change to the path makes a new store, so stale
+# results are never seen. Copies of a path share its store until one
+# of them changes.
+#
+# All stores together stay within a memory budget. When they hold more,
+# the results used least recently are dropped, and computed again
+# when they are needed.
+#
+# Paths can be drawn on several threads at once, see tiles.py, so
+# the bookkeeping of results is done holding a lock.
+
+import threading, weakref
+from array import array
+
+# The default memory budget in bytes.
+BUDGET = 64 * 1024 * 1024
+
+# When the budget is exceeded, results are dropped until
+# the cache holds no more than this part of it.
+LOW_WATER = 0.75
+
+class GeometryStore(dict):
+
+    """The cached geometry of one version of a path."""
+
+    def __init__(self, version):
+        dict.__init__(self)
+        self.version = version
+        # When the store was last used, see GeometryCache.
+        self.used = 0
+
+class GeometryCache(object):
+
+    """Keeps track of the results in all stores, and drops
+    the least recently used ones when they take more than the budget.
+    Results of the same store are used as recently as the store, and
+    of those the oldest go first.
+
+    >>> cache = GeometryCache(budget=1000)
+    >>> store = GeometryStore(0)
+    >>> len(cache.get(store, 'a', lambda: array('d', [0.0] * 60)))
+    60
+    >>> cache.size
+    544
+    >>> len(cache.get(store, 'b', lambda: array('d', [1.0] * 60)))
+    60
+    >>> sorted(store.keys()), cache.evictions
+    (['b'], 1)
+
+    Results are dropped when their store is no longer used:
+    >>> del store
+    >>> cache.size
+    0
+    """
+
+    def __init__(self, budget=BUDGET):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tick = 0
+        # Held while entries are added or dropped. Reentrant, since a store
+        # that is collected while it is held drops its entries.
+        self._lock = threading.RLock()
+        # (store id, key) -> (when it was added, size)
+        self._entries = {}
+        # store id -> (reference to the store, keys of its entries)
+        self._stores = {}
+
+    def get(self, store, key, make):
+        """Returns the result for key in the store, calling make()
+        to compute it when the store doesn't have it."""
+        self._tick += 1
+        store.used = self._tick
+        try:
+            value = store[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = make()
+        size = sizeof(value)
+        if size > self.budget:
+            # Too large to keep.
+            return value
+        sid = id(store)
+        self._lock.acquire()
+        try:
+            if (sid, key) in self._entries:
+                # Another thread made it first.
+                return store.get(key, value)
+            if sid not in self._stores:
+                ref = weakref.ref(store, lambda ref, sid=sid: self._forget(sid))
+                self._stores[sid] = (ref, set())
+            self._stores[sid][1].add(key)
+            self._entries[sid, key] = (self._tick, size)
+            store[key] = value
+            self.size += size
+            if self.size > self.budget:
+                self._evict(self.budget * LOW_WATER, keep=(sid, key))
+        finally:
+            self._lock.release()
+        return value
+
+    def clear(self):
+        """Drops all results."""
+        self._lock.acquire()
+        try:
+            self._evict(0)
+        finally:
+            self._lock.release()
+
+    def _evict(self, size, keep=None):
+        """Drops the least recently used results, except keep,
+        until the cache holds no more than size bytes."""
+        def age(item):
+            (sid, key), (added, nbytes) = item
+            store = self._stores[sid][0]()
+            if store is None:
+                return (0, added)
+            return (store.used, added)
+        entries = sorted(self._entries.items(), key=age)
+        for (sid, key), (added, nbytes) in entries:
+            if self.size <= size:
+                break
+            if (sid, key) == keep:
+                continue
+            del self._entries[sid, key]
+            ref, keys = self._stores[sid]
+            keys.discard(key)
+            if not keys:
+                del self._stores[sid]
+            store = ref()
+            if store is not None:
+                store.pop(key, None)
+            self.size -= nbytes
+            self.evictions += 1
+
+    def _forget(self, sid):
+        """Called when a store is gone: its results no longer take memory."""
+        self._lock.acquire()
+        try:
+            ref, keys = self._stores.pop(sid, (None, ()))
+            for key in keys:
+                self.size -= self._entries.pop((sid, key))[1]
+        finally:
+            self._lock.release()
+
+def sizeof(value):
+    """Estimates how many bytes a cached result takes.
+
+    >>> sizeof(array('d', [0.0] * 10))
+    144
+    >>> sizeof([0.5] * 10)
+    384
+    """
+    if isinstance(value, array):
+        return 64 + value.itemsize * len(value)
+    if isinstance(value, (list, tuple)):
+        size = 64 + 8 * len(value)
+        if value and isinstance(value[0], (int, long, float)):
+            # Lists of numbers can be long: don't look at every item.
+            return size + 24 * len(value)
+        for item in value:
+            size += sizeof(item)
+        return size
+    if hasattr(value, '_coords'):
+        # A path: count its storage, not its context and style.
+        return 256 + sizeof(value._cmds) + sizeof(value._coords)
+    if hasattr(value, '__dict__'):
+        return 64 + sum([sizeof(item) for item in value.__dict__.values()])
+    return 24
+
+# The cache of all paths.
+cache = GeometryCache()
+
+def _test():
+    import doctest, geometrycache
+    return doctest.testmod(geometrycache)
+
+if __name__=='__main__':
+    _test()
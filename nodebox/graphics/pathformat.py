@@ -0,0 +1,171 @@
+# Pathformat - a compact binary form of BezierPath geometry.
+#
+# Paths that are expensive to make can be stored once and loaded
+# in later runs, or by other processes, instead of being made again.
+# A stored path is laid out as:
+#
+#   header  16 bytes: the magic "NBPA", the format version, the flags,
+#           two unused bytes, the number of elements and the size of the style
+#   cmds    one byte per element
+#   padding zeros up to a multiple of 8 bytes, so the coordinates are aligned
+#   coords  six little-endian doubles per element, the way BezierPath stores them
+#   style   optional: fill, stroke, strokewidth, transform and transformmode
+#
+# Paths are stored one after the other, so a file can hold many of them.
+
+import struct, sys
+from array import array
+
+import Cairo
+
+from nodebox.graphics import BezierPath, Color, Transform, NodeBoxError, \
+    MOVETO, RECT, CENTER, CORNER
+
+MAGIC = "NBPA"
+VERSION = 1
+
+# The path has a style.
+HAS_STYLE = 1
+
+HEADER = struct.Struct('<4sBBxxII')
+# Whether there is a fill and a stroke, whether the transformmode is
+# CORNER, the fill and stroke as RGBA, the strokewidth and the transform matrix.
+STYLE = struct.Struct('<BBB4d4dd6d')
+
+def dumps(path, style=False):
+    """Returns the path as a string in the binary format.
+
+    The style of the path is only stored when style is True.
+
+    >>> path = BezierPath(None)
+    >>> path.moveto(0, 0)
+    >>> path.curveto(10, 0, 20, 10, 20, 20)
+    >>> path.closepath()
+    >>> data = dumps(path)
+    >>> len(data)
+    168
+    >>> list(loads(None, data)) == list(path)
+    True
+    """
+    start, end = path._range()
+    cmds = path._cmds[start:end]
+    coords = path._coords[start*6:end*6]
+    if sys.byteorder != 'little':
+        coords.byteswap()
+    flags = 0
+    data = ''
+    if style:
+        flags |= HAS_STYLE
+        data = _dump_style(path)
+    return ''.join((HEADER.pack(MAGIC, VERSION, flags, len(cmds), len(data)),
+                    cmds.tostring(), '\0' * _padding(len(cmds)),
+                    coords.tostring(), data))
+
+def loads(ctx, data, cls=BezierPath):
+    """Returns the path stored in the string, made with the given context.
+    Without a stored style, the path has the default style of a new path."""
+    if len(data) < HEADER.size:
+        raise NodeBoxError, "The data is too short to be a path"
+    count, size, flags = _header(data[:HEADER.size])
+    offset = HEADER.size
+    end = offset + count + _padding(count) + count * 48
+    if len(data) < end + size:
+        raise NodeBoxError, "The data is too short for the path it holds"
+    cmds = array('B')
+    cmds.fromstring(data[offset:offset+count])
+    offset += count + _padding(count)
+    coords = array('d')
+    coords.fromstring(data[offset:end])
+    offset = end
+    return _make(ctx, cls, cmds, coords, flags, data[offset:offset+size])
+
+def dump(path, f, style=False):
+    """Writes the path to an open file in the binary format."""
+    f.write(dumps(path, style))
+
+def load(ctx, f, cls=BezierPath):
+    """Reads the next path from an open file, see loads().
+    Real files are read straight into the arrays of the path."""
+    count, size, flags = _header(f.read(HEADER.size))
+    cmds = _read(f, 'B', count)
+    f.read(_padding(count))
+    coords = _read(f, 'd', count * 6)
+    data = f.read(size)
+    if len(data) != size:
+        raise NodeBoxError, "The file is too short for the path it holds"
+    return _make(ctx, cls, cmds, coords, flags, data)
+
+def _padding(count):
+    return -count % 8
+
+def _header(data):
+    if len(data) != HEADER.size:
+        raise NodeBoxError, "The data is too short to be a path"
+    magic, version, flags, count, size = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise NodeBoxError, "The data is not a path"
+    if version != VERSION:
+        raise NodeBoxError, "Can't read paths of format version %s" % version
+    return count, size, flags
+
+def _read(f, typecode, count):
+    values = array(typecode)
+    if isinstance(f, file):
+        try:
+            values.fromfile(f, count)
+        except EOFError:
+            raise NodeBoxError, "The file is too short for the path it holds"
+    else:
+        values.fromstring(f.read(count * values.itemsize))
+        if len(values) != count:
+            raise NodeBoxError, "The file is too short for the path it holds"
+    return values
+
+def _make(ctx, cls, cmds, coords, flags, style):
+    if cmds and (min(cmds) < MOVETO or max(cmds) > RECT):
+        raise NodeBoxError, "The data holds unknown path commands"
+    if sys.byteorder != 'little':
+        coords.byteswap()
+    path = cls(ctx)
+    path._replace(cmds, coords)
+    if flags & HAS_STYLE:
+        _load_style(path, style)
+    return path
+
+def _dump_style(path):
+    fill, stroke = path._fillcolor, path._strokecolor
+    rgba = []
+    for clr in (fill, stroke):
+        if clr is None:
+            rgba.extend((0.0, 0.0, 0.0, 0.0))
+        else:
+            rgba.extend((clr._rgb.R, clr._rgb.G, clr._rgb.B, clr._rgb.A))
+    values = [fill is not None, stroke is not None, path._transformmode == CORNER]
+    values.extend(rgba)
+    values.append(path._strokewidth)
+    values.extend(tuple(path._transform))
+    return STYLE.pack(*values)
+
+def _load_style(path, data):
+    if len(data) != STYLE.size:
+        raise NodeBoxError, "The style of the path can't be read"
+    values = STYLE.unpack(data)
+    has_fill, has_stroke, corner = values[:3]
+    ctx = path._ctx
+    if has_fill:
+        path._fillcolor = Color(ctx, Cairo.Color(*values[3:7]))
+    if has_stroke:
+        path._strokecolor = Color(ctx, Cairo.Color(*values[7:11]))
+    path._strokewidth = values[11]
+    path._transform = Transform(ctx, values[12:18])
+    if corner:
+        path._transformmode = CORNER
+    else:
+        path._transformmode = CENTER
+
+def _test():
+    import doctest, pathformat
+    return doctest.testmod(pathformat)
+
+if __name__=='__main__':
+    _test()
@@ -0,0 +1,178 @@
+# Tiles - draws the canvas in tiles, on a pool of threads.
+#
+# Drawing a large canvas on one thread leaves the other processors idle.
+# IronPython threads run at the same time, and Cairo draws into different
+# surfaces at the same time, so the canvas is split into square tiles
+# that workers draw, each into a surface of its own:
+#
+#   sort     the grobs go to the tiles they can paint in, in drawing order,
+#            so each tile only replays its own grobs
+#   draw     each worker takes the next tile, clears its surface and draws
+#            the background and the grobs of the tile, moved to the tile
+#   copy     the worker paints the finished tile onto the canvas image,
+#            one worker at a time
+#
+# Workers draw the same grobs at once, so drawing must only read them:
+# transforms are composed into copies, see RenderState.absolute(), and
+# what grobs cache, such as their bounds, is computed while sorting.
+# Tiles are painted onto the image the way a grob is, so a tiled draw
+# gives the same image as a plain one.
+
+import sys, threading
+from Queue import Queue, Empty
+
+import Cairo
+import System
+
+from nodebox.graphics.caironet import BezierPath, ClippingPath
+
+# The default size of a tile, in pixels.
+TILESIZE = 512
+
+def tiles(width, height, size=TILESIZE):
+    """Returns the tiles (left, top, right, bottom) covering the canvas, row by row.
+
+    >>> tiles(1000, 600, 512)
+    [(0, 0, 512, 512), (512, 0, 1000, 512), (0, 512, 512, 600), (512, 512, 1000, 600)]
+    """
+    width, height = int(width), int(height)
+    return [(x, y, min(x + size, width), min(y + size, height))
+            for y in xrange(0, height, size) for x in xrange(0, width, size)]
+
+def sort(grobs, width, height, size=TILESIZE, tolerance=None):
+    """Returns, for each tile, the grobs that can paint in it, in drawing
+    order, and the number of grobs that paint in no tile at all.
+
+    Paths are simplified with the tolerance first, when it is given.
+    """
+    width, height = int(width), int(height)
+    columns = (width + size - 1) // size
+    rows = (height + size - 1) // size
+    lists = [[] for i in xrange(columns * rows)]
+    culled = 0
+    for grob in grobs:
+        _prepare(grob, tolerance)
+        box = grob._paint_bounds()
+        if box is None:
+            for tile in lists:
+                tile.append(grob)
+            continue
+        left, top, right, bottom = box
+        if right <= 0 or bottom <= 0 or left >= width or top >= height:
+            culled += 1
+            continue
+        first_column, last_column = int(max(left, 0)) // size, min(int(right), width - 1) // size
+        first_row, last_row = int(max(top, 0)) // size, min(int(bottom), height - 1) // size
+        for row in xrange(first_row, last_row + 1):
+            for column in xrange(first_column, last_column + 1):
+                lists[row * columns + column].append(grob)
+    return lists, culled
+
+def _prepare(grob, tolerance):
+    """Computes what drawing the grob caches."""
+    if isinstance(grob, BezierPath):
+        grob._paint_bounds()
+        grob.bounds
+        if tolerance:
+            grob._simplified(tolerance)
+    elif isinstance(grob, ClippingPath):
+        grob.path.bounds
+        for child in grob._grobs:
+            _prepare(child, tolerance)
+
+def draw(canvas, size=TILESIZE, workers=None):
+    """Draws the canvas into its image in tiles of the given size, on as many
+    threads as workers, by default one for each processor. Unlike a plain
+    draw, it ignores the matrix of the canvas context: tiles are drawn
+    and copied onto the image in pixels. Sets canvas.stats, which also
+    holds the number of tiles that were drawn.
+
+    Drawing leaves the grobs as they were, also text, which every tile draws:
+    >>> from nodebox.graphics import Context
+    >>> ctx = Context()
+    >>> ctx.size(100, 100)
+    >>> ctx.text("hi", 10, 20) and None
+    >>> for i in range(2):
+    ...     draw(ctx.canvas, 64, 1)
+    ...     ctx.canvas.stats['tiles']
+    4
+    4
+    >>> ctx.canvas[0].transform
+    <Transform [1.000 0.000 0.000 1.000 0.000 0.000]>
+    """
+    if workers is None:
+        workers = System.Environment.ProcessorCount
+    boxes = tiles(canvas.width, canvas.height, size)
+    lists, culled = sort(canvas._grobs, canvas.width, canvas.height, size, canvas.simplify)
+
+    queue = Queue()
+    for box, grobs in zip(boxes, lists):
+        if grobs or canvas.background is not None:
+            queue.put((box, grobs))
+    count = queue.qsize()
+
+    target = canvas._context
+    lock = threading.Lock()
+    states = []
+    errors = []
+
+    def work():
+        surface = Cairo.ImageSurface(Cairo.Format.Argb32, size, size)
+        context = Cairo.Context(surface)
+        try:
+            try:
+                while not errors:
+                    try:
+                        box, grobs = queue.get_nowait()
+                    except Empty:
+                        break
+                    state = _draw_tile(canvas, context, box, grobs)
+                    left, top, right, bottom = box
+                    lock.acquire()
+                    try:
+                        target.Save()
+                        # The tiles are in pixels, whatever the matrix of the image.
+                        target.Matrix = Cairo.Matrix()
+                        target.SetSourceSurface(surface, left, top)
+                        target.Rectangle(left, top, right - left, bottom - top)
+                        target.Fill()
+                        target.Restore()
+                        states.append(state)
+                    finally:
+                        lock.release()
+            except:
+                errors.append(sys.exc_info())
+        finally:
+            context.Dispose(True)
+            surface.Destroy()
+
+    threads = [threading.Thread(target=work) for i in xrange(max(1, min(workers, count)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+    stats = canvas._stats(states)
+    stats['culled'] += culled
+    stats['tiles'] = count
+    canvas.stats = stats
+
+def _draw_tile(canvas, context, box, grobs):
+    left, top, right, bottom = box
+    context.Save()
+    context.Operator = Cairo.Operator.Clear
+    context.Paint()
+    context.Restore()
+    # Start without what the last tile left of its path.
+    context.NewPath()
+    context.Matrix = Cairo.Matrix(1, 0, 0, 1, -left, -top)
+    return canvas._render(context, grobs, (0, 0, right - left, bottom - top))
+
+def _test():
+    import doctest, tiles
+    return doctest.testmod(tiles)
+
+if __name__=='__main__':
+    _test()
@@ -1,4 +1,27 @@
 from math import sqrt, pow
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many t values the cost of converting to and from
+# NumPy arrays outweighs the gain of vectorizing.
+_NUMPY_THRESHOLD = 32
+
+# Abscissae and weights of 5-point Gauss-Legendre quadrature on [-1, 1].
+_GAUSS_LEGENDRE = (
+    ( 0.0,                0.5688888888888889),
+    (-0.5384693101056831, 0.4786286704993665),
+    ( 0.5384693101056831, 0.4786286704993665),
+    (-0.9061798459386640, 0.2369268850561891),
+    ( 0.9061798459386640, 0.2369268850561891),
+)
+
+# Adaptive curvelength() never splits the spline in intervals
+# smaller than this, which keeps it from looping forever on cusps.
+_MIN_INTERVAL = 1.0 / 2**20
 
 def linepoint(t, x0, y0, x1, y1):
 
@@ -17,6 +40,33 @@ def linepoint(t, x0, y0, x1, y1):
     out_y = y0 + t * (y1-y0)
     return (out_x, out_y)
 
+def linepoints(ts, x0, y0, x1, y1):
+
+    """Returns coordinates for each t in ts on the line.
+
+    Evaluates linepoint() for a whole sequence of t values
+    in one call, which is a lot faster than calling
+    linepoint() in a loop.
+
+    Returns a flat array of interleaved coordinates:
+    [x, y, x, y, ...], one pair for each t.
+    """
+
+    n = len(ts)
+    if numpy is not None and n >= _NUMPY_THRESHOLD:
+        t = numpy.asarray(ts, dtype=float)
+        out = numpy.empty((n, 2))
+        out[:,0] = x0 + t * (x1-x0)
+        out[:,1] = y0 + t * (y1-y0)
+        return array('d', out.tostring())
+
+    dx = x1-x0
+    dy = y1-y0
+    out = array('d', [0.0]) * (2*n)
+    out[0::2] = array('d', [x0 + t*dx for t in ts])
+    out[1::2] = array('d', [y0 + t*dy for t in ts])
+    return out
+
 def linelength(x0, y0, x1, y1):
 
     """Returns the length of the line."""
@@ -66,7 +116,123 @@ def curvepoint(t, x0, y0, x1, y1, x2, y2, x3, y3, handles=False):
     else:
         return (out_x, out_y, out_c1x, out_c1y, out_c2x, out_c2y, x01, y01, x23, y23)
 
-def curvelength(x0, y0, x1, y1, x2, y2, x3, y3, n=20):
+def curvepoints(ts, x0, y0, x1, y1, x2, y2, x3, y3, controls=False):
+
+    """Returns coordinates for each t in ts on the spline.
+
+    Evaluates the cubic bezier spline for a whole sequence
+    of t values in one call, which is a lot faster than
+    calling curvepoint() in a loop.
+
+    Returns a flat array of interleaved coordinates:
+    [x, y, x, y, ...], one pair for each t.
+
+    If the controls parameter is set, each point is followed
+    by the control points c1 and c2 around it, as curvepoint()
+    returns them without handles: [x, y, c1x, c1y, c2x, c2y, x, y, ...].
+    """
+
+    n = len(ts)
+    if controls:
+        if numpy is not None and n >= _NUMPY_THRESHOLD:
+            t = numpy.asarray(ts, dtype=float)
+            mint = 1 - t
+            x01 = x0 * mint + x1 * t
+            y01 = y0 * mint + y1 * t
+            x12 = x1 * mint + x2 * t
+            y12 = y1 * mint + y2 * t
+            x23 = x2 * mint + x3 * t
+            y23 = y2 * mint + y3 * t
+            out = numpy.empty((n, 6))
+            out[:,2] = x01 * mint + x12 * t
+            out[:,3] = y01 * mint + y12 * t
+            out[:,4] = x12 * mint + x23 * t
+            out[:,5] = y12 * mint + y23 * t
+            out[:,0] = out[:,2] * mint + out[:,4] * t
+            out[:,1] = out[:,3] * mint + out[:,5] * t
+            return array('d', out.tostring())
+        out = array('d', [0.0]) * (6*n)
+        j = 0
+        for t in ts:
+            mint = 1 - t
+            x12 = x1 * mint + x2 * t
+            y12 = y1 * mint + y2 * t
+            c1x = (x0 * mint + x1 * t) * mint + x12 * t
+            c1y = (y0 * mint + y1 * t) * mint + y12 * t
+            c2x = x12 * mint + (x2 * mint + x3 * t) * t
+            c2y = y12 * mint + (y2 * mint + y3 * t) * t
+            out[j:j+6] = array('d', (c1x * mint + c2x * t, c1y * mint + c2y * t,
+                                     c1x, c1y, c2x, c2y))
+            j += 6
+        return out
+
+    # Evaluate the polynomial form of the spline,
+    # x(t) = ((ax*t + bx)*t + cx)*t + x0,
+    # which needs far fewer operations per t than de Casteljau.
+    cx = 3 * (x1-x0)
+    bx = 3 * (x2-x1) - cx
+    ax = x3 - x0 - cx - bx
+    cy = 3 * (y1-y0)
+    by = 3 * (y2-y1) - cy
+    ay = y3 - y0 - cy - by
+
+    if numpy is not None and n >= _NUMPY_THRESHOLD:
+        t = numpy.asarray(ts, dtype=float)
+        out = numpy.empty((n, 2))
+        out[:,0] = ((ax*t + bx)*t + cx)*t + x0
+        out[:,1] = ((ay*t + by)*t + cy)*t + y0
+        return array('d', out.tostring())
+
+    out = array('d', [0.0]) * (2*n)
+    out[0::2] = array('d', [((ax*t + bx)*t + cx)*t + x0 for t in ts])
+    out[1::2] = array('d', [((ay*t + by)*t + cy)*t + y0 for t in ts])
+    return out
+
+def polylinelength(coords):
+
+    """Returns the length of the polyline.
+
+    The coords parameter is a flat sequence of interleaved
+    coordinates, as returned by linepoints() and curvepoints().
+    """
+
+    n = len(coords)
+    if n < 4:
+        return 0.0
+    if numpy is not None and n >= 2*_NUMPY_THRESHOLD:
+        pts = numpy.asarray(coords, dtype=float).reshape(-1, 2)
+        d = numpy.diff(pts, axis=0)
+        return float(numpy.sqrt((d*d).sum(axis=1)).sum())
+
+    length = 0.0
+    xi = coords[0]
+    yi = coords[1]
+    for j in xrange(2, n, 2):
+        x = coords[j]
+        y = coords[j+1]
+        length += sqrt((x-xi)*(x-xi) + (y-yi)*(y-yi))
+        xi = x
+        yi = y
+    return length
+
+def quadraticroots(a, b, c):
+
+    """Returns the real roots of a*t*t + b*t + c = 0.
+
+    Returns an empty list when there are none.
+    """
+
+    if a == 0:
+        if b == 0:
+            return []
+        return [-c / float(b)]
+    d = b*b - 4*a*c
+    if d < 0:
+        return []
+    d = sqrt(d)
+    return [(-b - d) / (2.0*a), (-b + d) / (2.0*a)]
+
+def curvelength(x0, y0, x1, y1, x2, y2, x3, y3, n=20, tolerance=None):
 
     """Returns the length of the spline.
 
@@ -80,19 +246,110 @@ def curvelength(x0, y0, x1, y1, x2, y2, x3, y3, n=20):
 
     The default n=20 is fine for most cases, usually
     resulting in a deviation of less than 0.01.
+
+    When a tolerance is given, n is ignored and the length
+    is integrated with adaptive Gauss-Legendre quadrature instead:
+    the spline is split in halves until the estimated error
+    is below the tolerance. This is both faster for small
+    curves and more accurate for large ones.
     """
 
-    length = 0
-    xi = x0
-    yi = y0
-
-    for i in range(n):
-        t = 1.0 * (i+1) / n
-        pt_x, pt_y, pt_c1x, pt_c1y, pt_c2x, pt_c2y = \
-            curvepoint(t, x0, y0, x1, y1, x2, y2, x3, y3)
-        c = sqrt(pow(abs(xi-pt_x),2) + pow(abs(yi-pt_y),2))
-        length += c
-        xi = pt_x
-        yi = pt_y
-        
+    if tolerance is None:
+        ts = [1.0 * i / n for i in xrange(n+1)]
+        return polylinelength(curvepoints(ts, x0, y0, x1, y1, x2, y2, x3, y3))
+
+    coefficients = _derivative(x0, y0, x1, y1, x2, y2, x3, y3)
+
+    # Sharp bends and cusps sit where x'(t) or y'(t) is zero.
+    # Starting with intervals that end there keeps the quadrature
+    # from stepping over them, which could hide the error.
+    ts = [0.0] + _extrema(coefficients) + [1.0]
+    tolerance /= len(ts) - 1
+
+    length = 0.0
+    stack = []
+    for i in xrange(len(ts)-1):
+        t0, t1 = ts[i], ts[i+1]
+        stack.append((t0, t1, _gausslength(coefficients, t0, t1), tolerance))
+    while stack:
+        t0, t1, estimate, tolerance = stack.pop()
+        tm = (t0 + t1) / 2
+        left = _gausslength(coefficients, t0, tm)
+        right = _gausslength(coefficients, tm, t1)
+        # The difference between both estimates overrates the error
+        # of the halves, but can by chance be small on a bad interval:
+        # demanding a quarter of the tolerance makes that unlikely.
+        if abs(left + right - estimate) <= tolerance / 4 or t1 - t0 <= _MIN_INTERVAL:
+            length += left + right
+        else:
+            stack.append((t0, tm, left, tolerance / 2))
+            stack.append((tm, t1, right, tolerance / 2))
     return length
+
+def curvebounds(x0, y0, x1, y1, x2, y2, x3, y3):
+
+    """Returns the bounding box of the spline.
+
+    Returns (min_x, min_y, max_x, max_y). Unlike the bounds
+    of the control points, this is the tight box around
+    the spline itself: besides its end points,
+    it includes the points where the spline turns,
+    where x'(t) or y'(t) is zero.
+    """
+
+    min_x, max_x = min(x0, x3), max(x0, x3)
+    min_y, max_y = min(y0, y3), max(y0, y3)
+
+    # The spline lies within the box around its control points,
+    # so if those already lie within the box there's nothing to find.
+    if min_x <= min(x1, x2) and max(x1, x2) <= max_x and \
+       min_y <= min(y1, y2) and max(y1, y2) <= max_y:
+        return (min_x, min_y, max_x, max_y)
+
+    for t in _extrema(_derivative(x0, y0, x1, y1, x2, y2, x3, y3)):
+        x, y = curvepoint(t, x0, y0, x1, y1, x2, y2, x3, y3)[:2]
+        min_x, max_x = min(min_x, x), max(max_x, x)
+        min_y, max_y = min(min_y, y), max(max_y, y)
+    return (min_x, min_y, max_x, max_y)
+
+def _derivative(x0, y0, x1, y1, x2, y2, x3, y3):
+
+    """Returns the coefficients of the derivative of the spline.
+
+    Returns (ax, bx, cx, ay, by, cy), where
+    x'(t) = (ax*t + bx)*t + cx and y'(t) = (ay*t + by)*t + cy.
+    """
+
+    return (3 * (x3 - 3*x2 + 3*x1 - x0), 6 * (x2 - 2*x1 + x0), 3 * (x1-x0),
+            3 * (y3 - 3*y2 + 3*y1 - y0), 6 * (y2 - 2*y1 + y0), 3 * (y1-y0))
+
+def _extrema(coefficients):
+
+    """Returns the sorted t values between 0.0 and 1.0 where
+    x'(t) or y'(t) is zero, for the coefficients of _derivative()."""
+
+    ax, bx, cx, ay, by, cy = coefficients
+    ts = quadraticroots(ax, bx, cx) + quadraticroots(ay, by, cy)
+    ts = [t for t in ts if 0 < t < 1]
+    ts.sort()
+    return ts
+
+def _gausslength(coefficients, t0, t1):
+
+    """Returns the length of the spline between t0 and t1.
+
+    Integrates the speed of the spline with Gauss-Legendre quadrature.
+    The coefficients are those of the derivative of the spline,
+    as returned by _derivative().
+    """
+
+    ax, bx, cx, ay, by, cy = coefficients
+    half = (t1 - t0) / 2
+    mid = (t1 + t0) / 2
+    length = 0.0
+    for x, w in _GAUSS_LEGENDRE:
+        t = mid + half * x
+        dx = (ax*t + bx)*t + cx
+        dy = (ay*t + by)*t + cy
+        length += w * sqrt(dx*dx + dy*dy)
+    return length * half